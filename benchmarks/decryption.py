@@ -0,0 +1,97 @@
+"""
+Measures sync-web3signer private key decryption throughput of both keys table layouts.
+
+    python -m benchmarks.decryption --count 10000 --jobs 4
+"""
+import asyncio
+import time
+from secrets import randbelow
+from typing import Iterable
+
+import click
+from eth_typing import HexStr
+from eth_utils import add_0x_prefix
+from py_ecc.optimized_bls12_381 import curve_order
+from web3 import Web3
+
+from key_manager.contrib import bytes_to_str, chunkify
+from key_manager.encryptor import PRIVATE_KEY_LENGTH, Encryptor, decrypt_private_keys
+from key_manager.typings import DatabaseKeyRecord, KeyBatch, KeyRecords
+
+
+@click.option('--count', default=10000, type=click.IntRange(min=1), help='Number of keys.')
+@click.option('--jobs', default=1, type=click.IntRange(min=1), help='Number of processes.')
+@click.option('--batch-size', default=1000, type=click.IntRange(min=1), help='Keys per batch.')
+@click.command()
+def main(count: int, jobs: int, batch_size: int) -> None:
+    encryptor = Encryptor()
+    records: list[DatabaseKeyRecord] = []
+    raw_private_keys = []
+    for index in range(count):
+        private_key = randbelow(curve_order - 1) + 1
+        raw_private_keys.append(private_key.to_bytes(PRIVATE_KEY_LENGTH, 'big'))
+        encrypted_private_key, nonce = encryptor.encrypt(str(private_key))
+        records.append(
+            DatabaseKeyRecord(
+                public_key=HexStr(f'0x{index:096x}'),
+                private_key=bytes_to_str(encrypted_private_key),
+                nonce=bytes_to_str(nonce),
+            )
+        )
+    binary_records = KeyBatch()
+    for index, (encrypted_private_key, nonce) in enumerate(
+        encryptor.encrypt_many(raw_private_keys)
+    ):
+        binary_records.append(
+            public_key=index.to_bytes(48, 'big'), private_key=encrypted_private_key, nonce=nonce
+        )
+
+    # the loop used by sync-web3signer before the batched engine
+    start = time.perf_counter()
+    expected = []
+    for record in records:
+        key = encryptor.decrypt(data=record.private_key, nonce=record.nonce)
+        key_hex = Web3.to_hex(int(key))
+        key_hex = HexStr(key_hex[2:].zfill(64))
+        expected.append(add_0x_prefix(key_hex))
+    elapsed = time.perf_counter() - start
+    click.echo(f'loop: {count / elapsed:.1f} keys/s ({elapsed:.2f}s)')
+
+    start = time.perf_counter()
+    private_keys = asyncio.run(
+        _decrypt_batched(chunkify(records, batch_size), decryption_key=encryptor.str_key, jobs=jobs)
+    )
+    elapsed = time.perf_counter() - start
+    assert private_keys == expected
+    click.echo(f'batched: {count / elapsed:.1f} keys/s ({elapsed:.2f}s, {jobs} jobs)')
+
+    start = time.perf_counter()
+    private_keys = asyncio.run(
+        _decrypt_batched(
+            (
+                binary_records.take(range(start, min(start + batch_size, count)))
+                for start in range(0, count, batch_size)
+            ),
+            decryption_key=encryptor.str_key,
+            jobs=jobs,
+        )
+    )
+    elapsed = time.perf_counter() - start
+    assert private_keys == expected
+    click.echo(f'batched v2 layout: {count / elapsed:.1f} keys/s ({elapsed:.2f}s, {jobs} jobs)')
+
+
+async def _decrypt_batched(
+    batches: Iterable[KeyRecords], decryption_key: str, jobs: int
+) -> list[HexStr]:
+    return [
+        private_key
+        async for batch in decrypt_private_keys(
+            batches=batches, decryption_key=decryption_key, jobs=jobs
+        )
+        for _, private_key in batch.keys
+    ]
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
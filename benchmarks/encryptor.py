@@ -0,0 +1,49 @@
+"""
+Compares the v1 Encryptor API with the batch API of the v2 layout.
+
+    python -m benchmarks.encryptor --count 100000
+"""
+import time
+from secrets import token_bytes
+
+import click
+
+from key_manager.contrib import bytes_to_str
+from key_manager.encryptor import PRIVATE_KEY_LENGTH, Encryptor
+
+
+@click.option('--count', default=100000, type=click.IntRange(min=1), help='Number of keys.')
+@click.command()
+def main(count: int) -> None:
+    encryptor = Encryptor()
+    private_keys = [token_bytes(PRIVATE_KEY_LENGTH) for _ in range(count)]
+
+    # the v1 layout: the decimal string of the private key, base64 columns, no tag
+    start = time.perf_counter()
+    records = []
+    for private_key in private_keys:
+        data, nonce = encryptor.encrypt(str(int.from_bytes(private_key, 'big')))
+        records.append((bytes_to_str(data), bytes_to_str(nonce)))
+    _echo('per-call encrypt, v1', count, start)
+
+    start = time.perf_counter()
+    for data, nonce in records:
+        int(encryptor.decrypt(data=data, nonce=nonce)).to_bytes(PRIVATE_KEY_LENGTH, 'big')
+    _echo('per-call decrypt, v1', count, start)
+
+    start = time.perf_counter()
+    encrypted = encryptor.encrypt_many(private_keys)
+    _echo('encrypt_many', count, start)
+
+    start = time.perf_counter()
+    assert encryptor.decrypt_many(encrypted) == private_keys
+    _echo('decrypt_many', count, start)
+
+
+def _echo(name: str, count: int, start: float) -> None:
+    elapsed = time.perf_counter() - start
+    click.echo(f'{name}: {count / elapsed:.0f} keys/s ({elapsed:.2f}s)')
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
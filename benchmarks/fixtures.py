@@ -0,0 +1,101 @@
+"""
+Reproducible synthetic EIP-2335 keystores for the benchmarks.
+"""
+import hashlib
+import json
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from Crypto.Cipher import AES  # nosec
+from py_ecc.optimized_bls12_381 import curve_order
+
+from key_manager.public_keys import fixed_base_public_key
+
+KEYSTORES_PASSWORD = 'benchmark'
+COMPLETE_MARKER_FILENAME = '.complete'
+
+
+def get_keystores_dir(data_dir: str, count: int, scrypt_n: int, seed: int) -> str:
+    return os.path.join(data_dir, f'keystores-{count}-n{scrypt_n}-s{seed}')
+
+
+def generate_keystores(keystores_dir: str, count: int, scrypt_n: int, seed: int, jobs: int) -> None:
+    """
+    Writes `count` keystores and the password file to `keystores_dir`.
+    The keystores depend only on the arguments, so the generated directory
+    is reused by the following runs.
+    """
+    if os.path.exists(os.path.join(keystores_dir, COMPLETE_MARKER_FILENAME)):
+        return
+
+    os.makedirs(keystores_dir, exist_ok=True)
+    with open(os.path.join(keystores_dir, 'password.txt'), 'w', encoding='utf-8') as f:
+        f.write(KEYSTORES_PASSWORD)
+
+    write = partial(_write_keystore, keystores_dir=keystores_dir, scrypt_n=scrypt_n, seed=seed)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for _ in executor.map(write, range(count), chunksize=64):
+            pass
+
+    with open(os.path.join(keystores_dir, COMPLETE_MARKER_FILENAME), 'w', encoding='utf-8'):
+        pass
+
+
+def _write_keystore(index: int, keystores_dir: str, scrypt_n: int, seed: int) -> None:
+    path = f'm/12381/3600/{index}/0/0'
+    filename = os.path.join(keystores_dir, f'keystore-{path.replace("/", "_")}.json')
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(_create_keystore(index, path, scrypt_n, seed), f)
+
+
+def _create_keystore(index: int, path: str, scrypt_n: int, seed: int) -> dict:
+    private_key = _derive_int(seed, index, 'private_key') % (curve_order - 1) + 1
+    salt = _derive_bytes(seed, index, 'salt', 32)
+    iv = _derive_bytes(seed, index, 'iv', 16)
+
+    decryption_key = hashlib.scrypt(
+        KEYSTORES_PASSWORD.encode('utf-8'),
+        salt=salt,
+        n=scrypt_n,
+        r=8,
+        p=1,
+        dklen=32,
+        maxmem=2**31 - 1,
+    )
+    cipher = AES.new(decryption_key[:16], AES.MODE_CTR, nonce=b'', initial_value=iv)
+    message = cipher.encrypt(private_key.to_bytes(32, 'big'))
+
+    return {
+        'crypto': {
+            'kdf': {
+                'function': 'scrypt',
+                'params': {'dklen': 32, 'n': scrypt_n, 'r': 8, 'p': 1, 'salt': salt.hex()},
+                'message': '',
+            },
+            'checksum': {
+                'function': 'sha256',
+                'params': {},
+                'message': hashlib.sha256(decryption_key[16:32] + message).hexdigest(),
+            },
+            'cipher': {
+                'function': 'aes-128-ctr',
+                'params': {'iv': iv.hex()},
+                'message': message.hex(),
+            },
+        },
+        'description': '',
+        'pubkey': fixed_base_public_key(private_key)[2:],
+        'path': path,
+        'uuid': str(uuid.UUID(bytes=_derive_bytes(seed, index, 'uuid', 16), version=4)),
+        'version': 4,
+    }
+
+
+def _derive_bytes(seed: int, index: int, name: str, size: int) -> bytes:
+    return hashlib.sha256(f'{seed}:{index}:{name}'.encode('ascii')).digest()[:size]
+
+
+def _derive_int(seed: int, index: int, name: str) -> int:
+    return int.from_bytes(_derive_bytes(seed, index, name, 32), 'big')
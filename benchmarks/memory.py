@@ -0,0 +1,77 @@
+"""
+Compares the memory held by the key records of a batch: the per-record objects
+of both layouts and the columns of `KeyBatch`.
+
+    python -m benchmarks.memory --count 100000
+"""
+import gc
+import tracemalloc
+from secrets import token_bytes
+from typing import Callable
+
+import click
+from eth_typing import HexStr
+
+from key_manager.contrib import bytes_to_str
+from key_manager.typings import BinaryKeyRecord, DatabaseKeyRecord, KeyBatch
+
+VAULT = '0x8a887282e67ff41d36c0b7537eabc3d0e5a5db92'
+
+
+@click.option('--count', default=100000, type=click.IntRange(min=1), help='Number of keys.')
+@click.command()
+def main(count: int) -> None:
+    rows = [(token_bytes(48), token_bytes(48), token_bytes(16)) for _ in range(count)]
+
+    # the records are built the way the database rows are converted
+    _measure(
+        'v1 records',
+        count,
+        lambda: [
+            DatabaseKeyRecord(
+                public_key=HexStr(f'0x{public_key.hex()}'),
+                private_key=bytes_to_str(private_key),
+                nonce=bytes_to_str(nonce),
+                vault=VAULT,
+            )
+            for public_key, private_key, nonce in rows
+        ],
+    )
+    _measure(
+        'v2 records',
+        count,
+        lambda: [
+            BinaryKeyRecord(
+                public_key=HexStr(f'0x{public_key.hex()}'),
+                private_key=bytes(private_key),
+                nonce=bytes(nonce),
+                vault=VAULT,
+            )
+            for public_key, private_key, nonce in rows
+        ],
+    )
+    _measure('key batch', count, lambda: _build_batch(rows))
+
+
+def _build_batch(rows: list[tuple[bytes, bytes, bytes]]) -> KeyBatch:
+    batch = KeyBatch()
+    for public_key, private_key, nonce in rows:
+        batch.append(public_key=public_key, private_key=private_key, nonce=nonce, vault=VAULT)
+    return batch
+
+
+def _measure(name: str, count: int, build: Callable[[], object]) -> None:
+    gc.collect()
+    tracemalloc.start()
+    records = build()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    click.echo(
+        f'{name}: {size / count:.0f} bytes/key held, {peak / count:.0f} bytes/key peak '
+        f'({size / 2 ** 20:.1f} MiB)'
+    )
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
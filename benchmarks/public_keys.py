@@ -0,0 +1,64 @@
+"""
+Measures public key derivation throughput of the update-db backends.
+
+    python -m benchmarks.public_keys --count 1000 --jobs 4
+"""
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from secrets import randbelow
+from tempfile import TemporaryDirectory
+
+import click
+from py_ecc.optimized_bls12_381 import curve_order
+
+from key_manager.public_keys import (
+    FIXED_BASE_SOURCE,
+    KEYSTORE_SOURCE,
+    PY_ECC_SOURCE,
+    fixed_base_public_key,
+    get_public_key_deriver,
+    py_ecc_public_key,
+)
+
+
+@click.option('--count', default=1000, type=click.IntRange(min=1), help='Number of keys.')
+@click.option('--jobs', default=1, type=click.IntRange(min=1), help='Number of processes.')
+@click.command()
+def main(count: int, jobs: int) -> None:
+    private_keys = [randbelow(curve_order - 1) + 1 for _ in range(count)]
+
+    # check the backends agree before timing them
+    for private_key in private_keys[:10]:
+        assert fixed_base_public_key(private_key) == py_ecc_public_key(private_key)
+
+    for source in (PY_ECC_SOURCE, FIXED_BASE_SOURCE):
+        deriver = get_public_key_deriver(source)
+        start = time.perf_counter()
+        if jobs == 1:
+            list(map(deriver, private_keys))
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                list(executor.map(deriver, private_keys, chunksize=64))
+        elapsed = time.perf_counter() - start
+        click.echo(f'{source}: {count / elapsed:.1f} keys/s ({elapsed:.2f}s, {jobs} jobs)')
+
+    with TemporaryDirectory() as tmp_dir:
+        filenames = []
+        for index, private_key in enumerate(private_keys):
+            filename = os.path.join(tmp_dir, f'keystore-{index}.json')
+            with open(filename, 'w', encoding='utf-8') as f:
+                json.dump({'pubkey': fixed_base_public_key(private_key)[2:]}, f)
+            filenames.append(filename)
+
+        start = time.perf_counter()
+        for filename in filenames:
+            with open(filename, 'r', encoding='utf-8') as f:
+                json.load(f)['pubkey']  # pylint: disable=expression-not-assigned
+        elapsed = time.perf_counter() - start
+        click.echo(f'{KEYSTORE_SOURCE}: {count / elapsed:.1f} keys/s ({elapsed:.2f}s, 1 jobs)')
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
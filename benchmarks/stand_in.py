@@ -0,0 +1,167 @@
+"""
+In-process stand-in of the Postgres database for the benchmarks.
+"""
+import json
+import os
+import time
+from typing import Generator
+
+from eth_typing import HexStr
+
+import key_manager.database
+from key_manager.contrib import chunkify
+from key_manager.database import KEYS_SCHEMA_V2, Database
+from key_manager.typings import BinaryKeyRecord, KeyBatch, KeyRecords, KeysMetadata
+
+STAND_IN_FILE_ENV = 'KEY_MANAGER_STAND_IN_FILE'
+
+
+class StandInDatabase(Database):
+    """
+    Keeps the keys in the JSON file set by `STAND_IN_FILE_ENV`,
+    so the keys uploaded by one command run are read by the next ones.
+    The keys are kept in memory during the run and saved once on close,
+    so the upload timings do not grow with the number of uploaded keys.
+    The keys are kept in the v2 layout.
+    The timings exclude the database server and the network.
+    """
+
+    def __init__(self, db_url: str):
+        super().__init__(db_url=db_url)
+        self.filename = os.environ[STAND_IN_FILE_ENV]
+        self.generation = 0
+        self.keys: dict[HexStr, BinaryKeyRecord] = {}
+        self._changed = False
+        # the sorted public keys by the vault, reset by the uploads
+        self._public_keys: dict[str | None, list[HexStr]] = {}
+
+    def connect(self) -> None:
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        self.generation = data['generation']
+        self.keys = {
+            row[0]: BinaryKeyRecord(
+                public_key=row[0],
+                private_key=bytes.fromhex(row[1]),
+                nonce=bytes.fromhex(row[2]),
+                vault=row[3],
+            )
+            for row in data['keys']
+        }
+
+    def close(self) -> None:
+        if not self._changed:
+            return
+        with open(self.filename, 'w', encoding='utf-8') as f:
+            json.dump(
+                {
+                    'generation': self.generation,
+                    'keys': [
+                        [key.public_key, key.private_key.hex(), key.nonce.hex(), key.vault.lower()]
+                        for key in self.keys.values()
+                    ],
+                },
+                f,
+            )
+        self._changed = False
+
+    def listen(self, channel: str) -> None:
+        pass
+
+    def wait_for_notification(self, timeout: float) -> bool:
+        time.sleep(timeout)
+        return False
+
+    def fetch_schema_version(self) -> int | None:
+        return KEYS_SCHEMA_V2 if self.keys else None
+
+    def upload_keys(self, keys: KeyRecords) -> None:
+        if not isinstance(keys, KeyBatch):
+            return
+        new_keys = [key for key in keys.to_records() if key.public_key not in self.keys]
+        if not new_keys:
+            return
+        self.generation += 1
+        self.keys.update((key.public_key, key) for key in new_keys)
+        self._public_keys.clear()
+        self._changed = True
+
+    def iter_public_keys(
+        self, batch_size: int, vault: str | None = None
+    ) -> Generator[list[HexStr], None, None]:
+        yield from chunkify(self._get_public_keys(vault), batch_size)
+
+    def fetch_public_keys_by_range(
+        self, start_after: HexStr | None, limit: int, vault: str | None = None
+    ) -> list[HexStr]:
+        public_keys = [
+            x for x in self._get_public_keys(vault) if start_after is None or x > start_after
+        ]
+        return public_keys[:limit]
+
+    def fetch_partition_boundary(
+        self, partition_size: int, partition_index: int, vault: str | None = None
+    ) -> HexStr | None:
+        if partition_size < 1 or partition_index < 1:
+            return None
+        public_keys = self._get_public_keys(vault)
+        position = partition_index * partition_size - 1
+        return public_keys[position] if position < len(public_keys) else None
+
+    def fetch_public_keys(self, vault: str | None = None) -> list[HexStr]:
+        return list(self._get_public_keys(vault))
+
+    def fetch_public_keys_count(self, vault: str | None = None) -> int:
+        return len(self._get_public_keys(vault))
+
+    def fetch_keys_metadata(self, vault: str | None = None) -> KeysMetadata | None:
+        return KeysMetadata(
+            generation=self.generation,
+            keys_count=len(self._get_public_keys(vault)),
+            keys_hash=str(self.generation),
+        )
+
+    def fetch_keys_fingerprint(self, vault: str | None = None) -> str:
+        return f'{self.generation}:{len(self._get_public_keys(vault))}'
+
+    def fetch_keys(self, vault: str | None = None) -> KeyRecords:
+        return KeyBatch.from_records(
+            self.keys[public_key] for public_key in self._get_public_keys(vault)
+        )
+
+    def iter_keys(
+        self,
+        batch_size: int,
+        after_generation: int | None = None,
+        vault: str | None = None,
+        start_after: HexStr | None = None,
+        limit: int | None = None,
+    ) -> Generator[KeyRecords, None, None]:
+        # the generations of the keys are not kept, the watch mode is not benchmarked
+        keys = [
+            self.keys[public_key]
+            for public_key in self._get_public_keys(vault)
+            if start_after is None or public_key > start_after
+        ]
+        for chunk in chunkify(keys[:limit], batch_size):
+            yield KeyBatch.from_records(chunk)
+
+    def _get_public_keys(self, vault: str | None) -> list[HexStr]:
+        vault = vault.lower() if vault is not None else None
+        if vault not in self._public_keys:
+            self._public_keys[vault] = sorted(
+                public_key
+                for public_key, key in self.keys.items()
+                if vault is None or key.vault.lower() == vault
+            )
+        return self._public_keys[vault]
+
+
+def install_stand_in() -> None:
+    """
+    Replaces `Database` for the commands imported after the call.
+    """
+    key_manager.database.Database = StandInDatabase  # type: ignore
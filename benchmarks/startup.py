@@ -0,0 +1,44 @@
+"""
+Measures the cold start time of the key-manager commands.
+
+    python -m benchmarks.startup --runs 10
+    python -m benchmarks.startup --executable ./dist/key-manager
+"""
+import statistics
+import subprocess  # nosec
+import sys
+import time
+
+import click
+
+from key_manager.main import COMMANDS
+
+
+@click.option('--runs', default=10, type=click.IntRange(min=1), help='Runs per command.')
+@click.option(
+    '--executable',
+    help='The key-manager binary built with PyInstaller. Defaults to the sources.',
+    type=click.Path(exists=True, file_okay=True, dir_okay=False),
+)
+@click.command()
+def main(runs: int, executable: str | None) -> None:
+    base_args = [executable] if executable else [sys.executable, '-m', 'key_manager.main']
+    commands: list[list[str]] = [[]] + [[name] for name in sorted(COMMANDS)]
+    for command in commands:
+        elapsed = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run(  # nosec
+                base_args + command + ['--help'], check=True, stdout=subprocess.DEVNULL
+            )
+            elapsed.append(time.perf_counter() - start)
+
+        name = ' '.join(command) or '(group)'
+        click.echo(
+            f'{name}: median {statistics.median(elapsed) * 1000:.0f}ms, '
+            f'min {min(elapsed) * 1000:.0f}ms'
+        )
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
@@ -21,7 +21,16 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=datas,
-    hiddenimports=['multiaddr.codecs.uint16be', 'multiaddr.codecs.idna'],
+    hiddenimports=[
+        'multiaddr.codecs.uint16be',
+        'multiaddr.codecs.idna',
+        # commands are imported by name in main.py
+        'key_manager.commands.update_db',
+        'key_manager.commands.sync_web3signer',
+        'key_manager.commands.sync_validator',
+        'key_manager.commands.assignment_report',
+        'key_manager.commands.migrate_db',
+    ],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
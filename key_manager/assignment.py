@@ -0,0 +1,98 @@
+import hashlib
+from typing import Iterable
+
+from eth_typing import HexStr
+
+RANGE_ASSIGNMENT = 'range'
+HASH_ASSIGNMENT = 'hash'
+
+ASSIGNMENTS = [RANGE_ASSIGNMENT, HASH_ASSIGNMENT]
+
+JUMP_HASH_MULTIPLIER = 2862933555777941757
+UINT64_MASK = (1 << 64) - 1
+
+
+def get_validator_keys_range(
+    validator_index: int, total_validators: int, public_keys_count: int
+) -> tuple[int, int]:
+    """
+    Returns the start and end positions of the validator keys in public key order
+    for the range assignment. The last validator also takes the remainder.
+    """
+    keys_per_validator = public_keys_count // total_validators
+    start_index = keys_per_validator * validator_index
+    if validator_index == total_validators - 1:
+        return start_index, public_keys_count
+    return start_index, start_index + keys_per_validator
+
+
+def get_hash_validator_index(public_key: HexStr, total_validators: int) -> int:
+    """
+    Returns the validator of the public key for the hash assignment.
+    The validator depends only on the public key and the total validators:
+    adding keys does not move other keys and changing the total validators
+    from N to M moves about |M - N| / max(M, N) of the keys.
+    """
+    digest = hashlib.blake2b(public_key.encode('ascii'), digest_size=8).digest()
+    return jump_hash(int.from_bytes(digest, 'big'), total_validators)
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """
+    Jump consistent hash by Lamping and Veach, maps the 64-bit key to a bucket
+    in `O(ln(buckets))` steps.
+    """
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * JUMP_HASH_MULTIPLIER + 1) & UINT64_MASK
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def assign_public_keys(
+    public_keys: Iterable[HexStr], total_validators: int, assignment: str
+) -> list[list[HexStr]]:
+    """
+    Splits the public keys between the validators.
+    The keys must be in public key order, the keys of each validator keep that order.
+    """
+    if assignment == RANGE_ASSIGNMENT:
+        public_keys = list(public_keys)
+        validators_keys = []
+        for validator_index in range(total_validators):
+            start_index, end_index = get_validator_keys_range(
+                validator_index, total_validators, len(public_keys)
+            )
+            validators_keys.append(public_keys[start_index:end_index])
+        return validators_keys
+
+    if assignment == HASH_ASSIGNMENT:
+        validators_keys = [[] for _ in range(total_validators)]
+        for public_key in public_keys:
+            validators_keys[get_hash_validator_index(public_key, total_validators)].append(
+                public_key
+            )
+        return validators_keys
+
+    raise ValueError(f'Unknown assignment {assignment}')
+
+
+def count_moved_keys(
+    validators_keys: list[list[HexStr]], new_validators_keys: list[list[HexStr]]
+) -> int:
+    """
+    Returns the number of keys assigned to a different validator
+    in the new assignment. Keys missing from either assignment are not counted.
+    """
+    key_validators = {
+        public_key: validator_index
+        for validator_index, public_keys in enumerate(validators_keys)
+        for public_key in public_keys
+    }
+    moved_keys_count = 0
+    for validator_index, public_keys in enumerate(new_validators_keys):
+        for public_key in public_keys:
+            if key_validators.get(public_key, validator_index) != validator_index:
+                moved_keys_count += 1
+    return moved_keys_count
@@ -0,0 +1,9 @@
+# the short help of the commands, also listed by the command group
+# without importing the command modules
+UPDATE_DB_HELP = 'Encrypt and load validator keys from the keystores into the database.'
+SYNC_WEB3SIGNER_HELP = 'Synchronizes web3signer private keys from the database'
+SYNC_VALIDATOR_HELP = (
+    'Creates validator configuration files for Lighthouse, Prysm, and Teku clients.'
+)
+ASSIGNMENT_REPORT_HELP = 'Reports how many keys move between validators.'
+MIGRATE_DB_HELP = 'Migrates the keys table to the v2 layout with binary columns.'
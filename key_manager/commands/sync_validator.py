@@ -1,24 +1,52 @@
+import itertools
 import json
+import os
+from contextlib import closing
 from pathlib import Path
+from typing import Generator, Iterable, Iterator
 
 import click
 import yaml
 from eth_typing import HexStr
 
-from key_manager.database import Database, check_db_connection
+from key_manager.assignment import (
+    ASSIGNMENTS,
+    HASH_ASSIGNMENT,
+    RANGE_ASSIGNMENT,
+    assign_public_keys,
+    get_hash_validator_index,
+    get_validator_keys_range,
+)
+from key_manager.commands import SYNC_VALIDATOR_HELP
+from key_manager.database import Database
+from key_manager.files import write_file_if_changed
+from key_manager.metrics import JSON_FORMAT, METRICS_FORMATS, Metrics, create_metrics
 from key_manager.validators import validate_db_uri, validate_eth_address
 
 VALIDATOR_DEFINITIONS_FILENAME = 'validator_definitions.yml'
 SIGNER_KEYS_FILENAME = 'signer_keys.yml'
 PROPOSER_CONFIG_FILENAME = 'proposer_config.json'
 
+# substituted by the public keys in the validator definitions entry
+PUBLIC_KEY_PLACEHOLDER = HexStr('0x' + '0' * 96)
+
+# the number of public keys fetched at once in the --all mode
+PUBLIC_KEYS_BATCH_SIZE = 10000
+
 
 @click.option(
     '--validator-index',
     help='The validator index to generate the configuration files.',
-    prompt='Enter the validator index to generate the configuration files',
     type=int,
 )
+@click.option(
+    '--all',
+    'all_validators',
+    is_flag=True,
+    default=False,
+    help='Generate the configuration files for every validator index in one pass over the keys. '
+    'The files of each validator are saved to the subdirectory named by its index.',
+)
 @click.option(
     '--total-validators',
     help='The total number of validators connected to the web3signer.',
@@ -57,58 +85,105 @@ PROPOSER_CONFIG_FILENAME = 'proposer_config.json'
     default='./data/configs',
     type=click.Path(exists=False, file_okay=False, dir_okay=True),
 )
+@click.option(
+    '--assignment',
+    help='The way to assign keys to validators: split the keys in public key order '
+    'into equal ranges, or hash the public keys, so adding keys or validators '
+    f'moves few keys between validators. Defaults to {RANGE_ASSIGNMENT}.',
+    default=RANGE_ASSIGNMENT,
+    type=click.Choice(ASSIGNMENTS),
+)
+@click.option(
+    '--vault',
+    help='The vault address to assign the keys of. Defaults to the keys of all vaults.',
+    callback=validate_eth_address,
+)
+@click.option(
+    '--metrics-file',
+    help='The file to save the durations and counters of the command phases to.',
+    type=click.Path(exists=False, file_okay=True, dir_okay=False),
+)
+@click.option(
+    '--metrics-format',
+    help=f'The format of the metrics file: JSON or the Prometheus textfile collector format. '
+    f'Defaults to {JSON_FORMAT}.',
+    default=JSON_FORMAT,
+    type=click.Choice(METRICS_FORMATS),
+)
 @click.command(
     help='Creates validator configuration files for Lighthouse, '
-    'Prysm, and Teku clients to sign data using keys from database.'
+    'Prysm, and Teku clients to sign data using keys from database.',
+    short_help=SYNC_VALIDATOR_HELP,
 )
 def sync_validator(
-    validator_index: int,
+    validator_index: int | None,
+    all_validators: bool,
     total_validators: int,
     db_url: str,
     web3signer_endpoint: str,
     fee_recipient: str,
     disable_proposal_builder: bool,
     output_dir: str,
+    assignment: str,
+    vault: str | None,
+    metrics_file: str | None,
+    metrics_format: str,
 ) -> None:
-    check_db_connection(db_url)
-    check_validator_index(validator_index, total_validators)
-
-    database = Database(db_url=db_url)
-    public_keys_count = database.fetch_public_keys_count()
+    metrics = create_metrics('sync-validator', metrics_file, metrics_format)
+    if all_validators:
+        if validator_index is not None:
+            raise click.BadParameter('--validator-index cannot be used with --all')
+        _sync_all_validators(
+            total_validators=total_validators,
+            db_url=db_url,
+            web3signer_endpoint=web3signer_endpoint,
+            fee_recipient=fee_recipient,
+            disable_proposal_builder=disable_proposal_builder,
+            output_dir=output_dir,
+            assignment=assignment,
+            vault=vault,
+            metrics=metrics,
+        )
+        return
 
-    keys_per_validator = public_keys_count // total_validators
-
-    start_index = keys_per_validator * validator_index
-    if validator_index == total_validators - 1:
-        end_index = public_keys_count
-    else:
-        end_index = start_index + keys_per_validator
+    if validator_index is None:
+        validator_index = click.prompt(
+            'Enter the validator index to generate the configuration files', type=int
+        )
+    check_validator_index(validator_index, total_validators)
 
-    public_keys = database.fetch_public_keys_by_range(start_index=start_index, end_index=end_index)
+    with Database(db_url=db_url) as database, metrics.phase('db_fetch_public_keys') as phase:
+        if assignment == HASH_ASSIGNMENT:
+            public_keys = [
+                public_key
+                for public_key in itertools.chain.from_iterable(
+                    database.iter_public_keys(batch_size=PUBLIC_KEYS_BATCH_SIZE, vault=vault)
+                )
+                if get_hash_validator_index(public_key, total_validators) == validator_index
+            ]
+        else:
+            public_keys = _fetch_validator_keys_range(
+                database=database,
+                validator_index=validator_index,
+                total_validators=total_validators,
+                vault=vault,
+            )
+        phase.rows += len(public_keys)
 
     if not public_keys:
         raise click.ClickException('Database does not contain in range')
 
-    Path.mkdir(Path(output_dir), exist_ok=True, parents=True)
-
-    # lighthouse
-    validator_definitions_filepath = str(Path(output_dir, VALIDATOR_DEFINITIONS_FILENAME))
-    _generate_lighthouse_config(
+    (
+        validator_definitions_filepath,
+        signer_keys_filepath,
+        proposer_config_filepath,
+    ) = _generate_configs(
         public_keys=public_keys,
-        web3signer_url=web3signer_endpoint,
+        web3signer_endpoint=web3signer_endpoint,
         fee_recipient=fee_recipient,
-        filepath=validator_definitions_filepath,
-    )
-
-    # teku/prysm
-    signer_keys_filepath = str(Path(output_dir, SIGNER_KEYS_FILENAME))
-    _generate_signer_keys_config(public_keys=public_keys, filepath=signer_keys_filepath)
-
-    proposer_config_filepath = str(Path(output_dir, PROPOSER_CONFIG_FILENAME))
-    _generate_proposer_config(
-        fee_recipient=fee_recipient,
-        proposal_builder_enabled=not disable_proposal_builder,
-        filepath=proposer_config_filepath,
+        disable_proposal_builder=disable_proposal_builder,
+        output_dir=output_dir,
+        metrics=metrics,
     )
 
     click.clear()
@@ -123,45 +198,210 @@ def sync_validator(
     )
 
 
-def _generate_lighthouse_config(
+def _fetch_validator_keys_range(
+    database: Database, validator_index: int, total_validators: int, vault: str | None
+) -> list[HexStr]:
+    public_keys_count = database.fetch_public_keys_count(vault=vault)
+
+    start_index, end_index = get_validator_keys_range(
+        validator_index, total_validators, public_keys_count
+    )
+    if end_index <= start_index:
+        return []
+
+    # the range starts after the stored boundary of the preceding partitions
+    start_after = database.fetch_partition_boundary(
+        partition_size=public_keys_count // total_validators,
+        partition_index=validator_index,
+        vault=vault,
+    )
+
+    return database.fetch_public_keys_by_range(
+        start_after=start_after, limit=end_index - start_index, vault=vault
+    )
+
+
+def _sync_all_validators(
+    total_validators: int,
+    db_url: str,
+    web3signer_endpoint: str,
+    fee_recipient: str,
+    disable_proposal_builder: bool,
+    output_dir: str,
+    assignment: str,
+    vault: str | None,
+    metrics: Metrics,
+) -> None:
+    """
+    Scans the public keys once in public key order and generates the configs
+    of every validator index with the same assignment as `--validator-index`.
+    """
+    public_keys_count = 0
+    # the server-side cursor is closed before the connection
+    with Database(db_url=db_url) as database, closing(
+        _iter_validators_public_keys(database, total_validators, assignment, vault)
+    ) as validators_public_keys:
+        for validator_index in range(total_validators):
+            with metrics.phase('db_fetch_public_keys') as phase:
+                public_keys = next(validators_public_keys)
+                phase.rows += len(public_keys)
+            if not public_keys:
+                raise click.ClickException('Database does not contain keys for every validator')
+
+            _generate_configs(
+                public_keys=public_keys,
+                web3signer_endpoint=web3signer_endpoint,
+                fee_recipient=fee_recipient,
+                disable_proposal_builder=disable_proposal_builder,
+                output_dir=str(Path(output_dir, str(validator_index))),
+                metrics=metrics,
+            )
+            public_keys_count += len(public_keys)
+
+    click.clear()
+    click.secho(
+        f'Done. '
+        f'Generated configs with {public_keys_count} keys for {total_validators} validators.\n'
+        f'Configuration files saved to the {output_dir}/<validator index> directories.\n',
+        bold=True,
+        fg='green',
+    )
+
+
+def _iter_validators_public_keys(
+    database: Database, total_validators: int, assignment: str, vault: str | None
+) -> Generator[list[HexStr], None, None]:
+    """
+    Yields the public keys of every validator index in one pass over the keys.
+    """
+    with closing(
+        database.iter_public_keys(batch_size=PUBLIC_KEYS_BATCH_SIZE, vault=vault)
+    ) as public_keys_batches:
+        public_keys_iterator = itertools.chain.from_iterable(public_keys_batches)
+        if assignment == HASH_ASSIGNMENT:
+            yield from assign_public_keys(public_keys_iterator, total_validators, assignment)
+            return
+
+        # the range assignment holds the keys of one validator at a time
+        public_keys_count = database.fetch_public_keys_count(vault=vault)
+        for validator_index in range(total_validators):
+            start_index, end_index = get_validator_keys_range(
+                validator_index, total_validators, public_keys_count
+            )
+            yield list(itertools.islice(public_keys_iterator, end_index - start_index))
+
+
+def _generate_configs(
     public_keys: list[HexStr],
+    web3signer_endpoint: str,
+    fee_recipient: str,
+    disable_proposal_builder: bool,
+    output_dir: str,
+    metrics: Metrics,
+) -> tuple[str, str, str]:
+    """
+    Generates the configs of a validator, returns the paths of the generated files.
+    The written bytes are counted only for the files which content has changed.
+    """
+    Path.mkdir(Path(output_dir), exist_ok=True, parents=True)
+
+    # lighthouse
+    validator_definitions_filepath = str(Path(output_dir, VALIDATOR_DEFINITIONS_FILENAME))
+    with metrics.phase('lighthouse_config') as phase:
+        if _generate_lighthouse_config(
+            public_keys=public_keys,
+            web3signer_url=web3signer_endpoint,
+            fee_recipient=fee_recipient,
+            filepath=validator_definitions_filepath,
+        ):
+            phase.bytes += os.path.getsize(validator_definitions_filepath)
+        phase.items += len(public_keys)
+
+    # teku/prysm
+    signer_keys_filepath = str(Path(output_dir, SIGNER_KEYS_FILENAME))
+    with metrics.phase('signer_keys_config') as phase:
+        if _generate_signer_keys_config(public_keys=public_keys, filepath=signer_keys_filepath):
+            phase.bytes += os.path.getsize(signer_keys_filepath)
+        phase.items += len(public_keys)
+
+    proposer_config_filepath = str(Path(output_dir, PROPOSER_CONFIG_FILENAME))
+    with metrics.phase('proposer_config') as phase:
+        if _generate_proposer_config(
+            fee_recipient=fee_recipient,
+            proposal_builder_enabled=not disable_proposal_builder,
+            filepath=proposer_config_filepath,
+        ):
+            phase.bytes += os.path.getsize(proposer_config_filepath)
+        phase.items += 1
+    return validator_definitions_filepath, signer_keys_filepath, proposer_config_filepath
+
+
+def _generate_lighthouse_config(
+    public_keys: Iterable[HexStr],
     web3signer_url: str,
     fee_recipient: str,
     filepath: str,
-) -> None:
+) -> bool:
     """
     Generate config for Lighthouse clients
     """
-    items = [
-        {
-            'enabled': True,
-            'voting_public_key': public_key,
-            'type': 'web3signer',
-            'url': web3signer_url,
-            'suggested_fee_recipient': fee_recipient,
-        }
-        for public_key in public_keys
-    ]
-
-    with open(filepath, 'w', encoding='utf-8') as f:
-        yaml.dump(items, f, explicit_start=True)
-
-
-def _generate_signer_keys_config(public_keys: list[HexStr], filepath: str) -> None:
+    return write_file_if_changed(
+        filepath,
+        _iter_lighthouse_config(
+            public_keys=public_keys, web3signer_url=web3signer_url, fee_recipient=fee_recipient
+        ),
+    )
+
+
+def _iter_lighthouse_config(
+    public_keys: Iterable[HexStr], web3signer_url: str, fee_recipient: str
+) -> Iterator[str]:
+    """
+    Yields the validator definitions yaml by entries.
+    Only the public key differs between the entries, so the entry is dumped once
+    and the public keys are substituted. The public keys are hex strings quoted
+    by yaml the same way as the placeholder, so the output matches `yaml.dump`.
+    """
+    item = {
+        'enabled': True,
+        'voting_public_key': PUBLIC_KEY_PLACEHOLDER,
+        'type': 'web3signer',
+        'url': web3signer_url,
+        'suggested_fee_recipient': fee_recipient,
+    }
+    # the public key is the last field of the sorted entry
+    prefix, suffix = yaml.dump([item]).rsplit(PUBLIC_KEY_PLACEHOLDER, 1)
+
+    is_empty = True
+    for public_key in public_keys:
+        if is_empty:
+            yield '---\n'
+            is_empty = False
+        yield f'{prefix}{public_key}{suffix}'
+
+    if is_empty:
+        yield yaml.dump([], explicit_start=True)
+
+
+def _generate_signer_keys_config(public_keys: Iterable[HexStr], filepath: str) -> bool:
     """
     Generate config for Teku and Prysm clients
     """
-    keys = ','.join([f'"{public_key}"' for public_key in public_keys])
-    config = f"""validators-external-signer-public-keys: [{keys}]"""
-    with open(filepath, 'w', encoding='utf-8') as f:
-        f.write(config)
+    return write_file_if_changed(filepath, _iter_signer_keys_config(public_keys))
+
+
+def _iter_signer_keys_config(public_keys: Iterable[HexStr]) -> Iterator[str]:
+    yield 'validators-external-signer-public-keys: ['
+    for index, public_key in enumerate(public_keys):
+        yield f',"{public_key}"' if index else f'"{public_key}"'
+    yield ']'
 
 
 def _generate_proposer_config(
     fee_recipient: str,
     proposal_builder_enabled: bool,
     filepath: str,
-) -> None:
+) -> bool:
     """
     Generate proposal config for Teku and Prysm clients
     """
@@ -173,8 +413,7 @@ def _generate_proposer_config(
             },
         },
     }
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(config, f, ensure_ascii=False, indent=4)
+    return write_file_if_changed(filepath, [json.dumps(config, ensure_ascii=False, indent=4)])
 
 
 def check_validator_index(validator_index, total_validators):
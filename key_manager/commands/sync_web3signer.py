@@ -1,21 +1,43 @@
-import glob
+import asyncio
+import json
 import os
 from os import mkdir
 from os.path import exists
-from typing import List
+from typing import AsyncIterable, AsyncIterator, Iterator
 
 import click
 import yaml
-from eth_utils import add_0x_prefix
-from web3 import Web3
-from web3.types import HexStr
+from eth_typing import HexStr
 
-from key_manager.contrib import is_lists_equal
-from key_manager.database import Database, check_db_connection
-from key_manager.encryptor import Encryptor
-from key_manager.validators import validate_db_uri, validate_env_name
+from key_manager.assignment import (
+    ASSIGNMENTS,
+    HASH_ASSIGNMENT,
+    RANGE_ASSIGNMENT,
+    get_hash_validator_index,
+    get_validator_keys_range,
+)
+from key_manager.commands import SYNC_WEB3SIGNER_HELP
+from key_manager.contrib import async_command
+from key_manager.database import CONNECTION_ERRORS, KEYS_UPDATED_CHANNEL, AsyncDatabase
+from key_manager.encryptor import decrypt_private_keys
+from key_manager.files import write_file_atomic
+from key_manager.metrics import JSON_FORMAT, METRICS_FORMATS, Metrics, create_metrics
+from key_manager.settings import DECRYPTION_KEY_ENV
+from key_manager.typings import (
+    DatabaseKeyRecord,
+    KeyBatch,
+    KeyBatchRow,
+    KeyRecords,
+    KeysMetadata,
+)
+from key_manager.validators import (
+    validate_db_uri,
+    validate_env_name,
+    validate_eth_address,
+)
 
-DECRYPTION_KEY_ENV = 'DECRYPTION_KEY'
+KEY_FILE_EXTENSION = '.yaml'
+MANIFEST_FILENAME = '.manifest.json'
 
 
 @click.option(
@@ -36,58 +58,567 @@ DECRYPTION_KEY_ENV = 'DECRYPTION_KEY'
     default=DECRYPTION_KEY_ENV,
     callback=validate_env_name,
 )
-@click.command(help='Synchronizes web3signer private keys from the database')
-def sync_web3signer(db_url: str, output_dir: str, decryption_key_env: str) -> None:
+@click.option(
+    '--vault',
+    help='The vault address to sync the keys of. Defaults to the keys of all vaults.',
+    callback=validate_eth_address,
+)
+@click.option(
+    '--shard-index',
+    help='The index of the shard of the keys to sync. Use the --validator-index '
+    'of sync-validator for the validator paired with the signer.',
+    type=click.IntRange(min=0),
+)
+@click.option(
+    '--total-shards',
+    help='The total number of shards. Use the --total-validators of sync-validator '
+    'to pair the signers with the validators. Defaults to syncing all the keys.',
+    type=click.IntRange(min=1),
+)
+@click.option(
+    '--assignment',
+    help='The way to assign keys to the shards, use the --assignment of sync-validator. '
+    f'Defaults to {RANGE_ASSIGNMENT}.',
+    default=RANGE_ASSIGNMENT,
+    type=click.Choice(ASSIGNMENTS),
+)
+@click.option(
+    '--batch-size',
+    help='The number of keys fetched from the database at once. Defaults to 1000.',
+    default=1000,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    '--jobs',
+    help='The number of processes used to decrypt the keys. Defaults to the CPU count.',
+    default=lambda: os.cpu_count() or 1,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    '--watch',
+    is_flag=True,
+    default=False,
+    help='Keep running and apply the keys uploaded by update-db as they are committed.',
+)
+@click.option(
+    '--watch-interval',
+    help='The maximum number of seconds between database checks in the watch mode. '
+    'Defaults to 60.',
+    default=60,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    '--metrics-file',
+    help='The file to save the durations and counters of the command phases to.',
+    type=click.Path(exists=False, file_okay=True, dir_okay=False),
+)
+@click.option(
+    '--metrics-format',
+    help=f'The format of the metrics file: JSON or the Prometheus textfile collector format. '
+    f'Defaults to {JSON_FORMAT}.',
+    default=JSON_FORMAT,
+    type=click.Choice(METRICS_FORMATS),
+)
+@click.command(help=SYNC_WEB3SIGNER_HELP)
+@async_command
+async def sync_web3signer(
+    db_url: str,
+    output_dir: str,
+    decryption_key_env: str,
+    vault: str | None,
+    shard_index: int | None,
+    total_shards: int | None,
+    assignment: str,
+    batch_size: int,
+    jobs: int,
+    watch: bool,
+    watch_interval: int,
+    metrics_file: str | None,
+    metrics_format: str,
+) -> None:
     """
     The command is running by the init container in web3signer pods.
     Fetch and decrypt keys for web3signer and store them as keypairs in the output_dir.
+    Key files are named by public key, so only added keys are decrypted and written
+    and only removed keys are deleted.
+    In the watch mode the command keeps running and applies the keys
+    of every update-db upload notified through Postgres LISTEN/NOTIFY.
+    With the vault only the keys of the vault are synced.
+    With the shard only the keys of the validator with the same index are synced.
     """
-    check_db_connection(db_url)
+    if (shard_index is None) != (total_shards is None):
+        raise click.BadParameter('--shard-index and --total-shards must be used together')
+    if shard_index is not None and total_shards is not None and shard_index >= total_shards:
+        raise click.BadParameter('shard index must be less than total shards')
 
-    database = Database(db_url=db_url)
-    keys_records = database.fetch_keys()
+    metrics = create_metrics('sync-web3signer', metrics_file, metrics_format)
+    if not exists(output_dir):
+        mkdir(output_dir)
+
+    # remove files left by interrupted writes
+    for filename in os.listdir(output_dir):
+        if filename.endswith(f'{KEY_FILE_EXTENSION}.tmp'):
+            os.remove(os.path.join(output_dir, filename))
 
-    # decrypt private keys
     decryption_key = os.environ[decryption_key_env]
-    decryptor = Encryptor(decryption_key)
-    private_keys: List[str] = []
-    for key_record in keys_records:
-        key = decryptor.decrypt(data=key_record.private_key, nonce=key_record.nonce)
-        key_hex = Web3.to_hex(int(key))
-        key_hex = HexStr(key_hex[2:].zfill(64))  # pad missing leading zeros
-        private_keys.append(add_0x_prefix(key_hex))
 
-    if not exists(output_dir):
-        mkdir(output_dir)
+    async with AsyncDatabase(db_url=db_url) as database:
+        if not watch:
+            await _sync_keys(
+                database=database,
+                output_dir=output_dir,
+                decryption_key=decryption_key,
+                vault=vault,
+                shard_index=shard_index,
+                total_shards=total_shards,
+                assignment=assignment,
+                batch_size=batch_size,
+                jobs=jobs,
+                metrics=metrics,
+            )
+            return
 
-    # check current keys
-    current_keys = []
-    for filename in glob.glob(os.path.join(output_dir, '*.yaml')):
-        with open(filename, 'r', encoding='utf-8') as f:
-            content = yaml.safe_load(f.read())
-            current_keys.append(content.get('privateKey'))
-
-    if is_lists_equal(current_keys, private_keys):
-        click.secho(
-            'Keys already synced to the last version.\n',
-            bold=True,
-            fg='green',
+        while True:
+            try:
+                await _watch_keys(
+                    database=database,
+                    output_dir=output_dir,
+                    decryption_key=decryption_key,
+                    vault=vault,
+                    shard_index=shard_index,
+                    total_shards=total_shards,
+                    assignment=assignment,
+                    batch_size=batch_size,
+                    jobs=jobs,
+                    watch_interval=watch_interval,
+                    metrics=metrics,
+                )
+            except CONNECTION_ERRORS as e:
+                # the server restarts and idle timeouts do not stop the watch mode,
+                # the keys are synced again after the reconnection
+                click.secho(f'Lost the database connection. Error details: {e}', fg='red')
+                await _reconnect(database, watch_interval)
+
+
+async def _watch_keys(
+    database: AsyncDatabase,
+    output_dir: str,
+    decryption_key: str,
+    vault: str | None,
+    shard_index: int | None,
+    total_shards: int | None,
+    assignment: str,
+    batch_size: int,
+    jobs: int,
+    watch_interval: int,
+    metrics: Metrics,
+) -> None:
+    """
+    Syncs the keys and applies the changes of the keys table as they are committed.
+    """
+    # subscribe before the first sync, so no upload is missed
+    await database.listen(KEYS_UPDATED_CHANNEL)
+
+    with metrics.phase('db_fetch_keys_metadata'):
+        metadata = await database.fetch_keys_metadata(vault=vault)
+    await _sync_keys(
+        database=database,
+        output_dir=output_dir,
+        decryption_key=decryption_key,
+        vault=vault,
+        shard_index=shard_index,
+        total_shards=total_shards,
+        assignment=assignment,
+        batch_size=batch_size,
+        jobs=jobs,
+        metrics=metrics,
+    )
+
+    while True:
+        # check the metadata on timeout as well in case a notification was missed
+        # or the keys were changed outside update-db
+        await database.wait_for_notification(timeout=watch_interval)
+        with metrics.phase('db_fetch_keys_metadata'):
+            new_metadata = await database.fetch_keys_metadata(vault=vault)
+        if not new_metadata or new_metadata == metadata:
+            continue
+
+        if (
+            metadata is None
+            or (total_shards is not None and assignment == RANGE_ASSIGNMENT)
+            or not await _is_keys_upload(database, metadata, new_metadata, vault)
+        ):
+            # the uploaded keys move the range boundaries of the shard,
+            # and the removed keys are found only by comparing all the keys
+            await _sync_keys(
+                database=database,
+                output_dir=output_dir,
+                decryption_key=decryption_key,
+                vault=vault,
+                shard_index=shard_index,
+                total_shards=total_shards,
+                assignment=assignment,
+                batch_size=batch_size,
+                jobs=jobs,
+                metrics=metrics,
+            )
+        else:
+            await _apply_uploaded_keys(
+                database=database,
+                output_dir=output_dir,
+                decryption_key=decryption_key,
+                vault=vault,
+                shard_index=shard_index,
+                total_shards=total_shards,
+                assignment=assignment,
+                batch_size=batch_size,
+                jobs=jobs,
+                after_generation=metadata.generation,
+                metrics=metrics,
+            )
+        metadata = new_metadata
+
+
+async def _reconnect(database: AsyncDatabase, interval: int) -> None:
+    """
+    Opens a new connection, retrying every `interval` seconds while the server is unavailable.
+    """
+    while True:
+        try:
+            await database.reconnect()
+            return
+        except click.ClickException as e:
+            click.secho(f'{e.message.strip()} Retrying in {interval} seconds.', fg='red')
+            await asyncio.sleep(interval)
+
+
+async def _is_keys_upload(
+    database: AsyncDatabase,
+    metadata: KeysMetadata,
+    new_metadata: KeysMetadata,
+    vault: str | None,
+) -> bool:
+    """
+    Checks that the keys were only added by the uploads since the metadata:
+    the keys of the new generations make up the whole change of the keys count and hash.
+    """
+    if new_metadata.generation <= metadata.generation:
+        return False
+    uploaded = await database.fetch_uploaded_keys_metadata(
+        after_generation=metadata.generation, generation=new_metadata.generation, vault=vault
+    )
+    keys_count = metadata.keys_count + uploaded.keys_count
+    keys_hash = int(metadata.keys_hash) + int(uploaded.keys_hash)
+    return keys_count == new_metadata.keys_count and keys_hash == int(new_metadata.keys_hash)
+
+
+async def _sync_keys(
+    database: AsyncDatabase,
+    output_dir: str,
+    decryption_key: str,
+    vault: str | None,
+    shard_index: int | None,
+    total_shards: int | None,
+    assignment: str,
+    batch_size: int,
+    jobs: int,
+    metrics: Metrics,
+) -> None:
+    current_filenames = set(_list_key_files(output_dir))
+    current_files_count = len(current_filenames)
+
+    # compare the database state with the state of the last sync
+    with metrics.phase('db_fetch_keys_fingerprint'):
+        fingerprint = await _fetch_fingerprint(
+            database=database,
+            vault=vault,
+            shard_index=shard_index,
+            total_shards=total_shards,
+            assignment=assignment,
         )
+    manifest = _read_manifest(output_dir)
+    if manifest == {'fingerprint': fingerprint, 'keys_count': current_files_count}:
+        _print_already_synced(current_files_count)
         return
 
-    # save key files
-    for index, private_key in enumerate(private_keys):
-        filename = f'key_{index}.yaml'
-        with open(os.path.join(output_dir, filename), 'w', encoding='utf-8') as f:
-            f.write(_generate_key_file(private_key))
+    added_keys_count = await _write_new_keys(
+        batches=_filter_new_keys(
+            metrics.iter_rows(
+                'db_fetch_keys',
+                _iter_shard_keys(
+                    database=database,
+                    batch_size=batch_size,
+                    vault=vault,
+                    shard_index=shard_index,
+                    total_shards=total_shards,
+                    assignment=assignment,
+                ),
+            ),
+            current_filenames,
+        ),
+        output_dir=output_dir,
+        decryption_key=decryption_key,
+        jobs=jobs,
+        metrics=metrics,
+    )
+
+    # the files left are not in the database anymore
+    with metrics.phase('file_delete') as phase:
+        for filename in current_filenames:
+            os.remove(os.path.join(output_dir, filename))
+        phase.items += len(current_filenames)
+    removed_keys_count = len(current_filenames)
+    unchanged_keys_count = current_files_count - removed_keys_count
+
+    _write_manifest(output_dir, fingerprint, added_keys_count + unchanged_keys_count)
+
+    if not added_keys_count and not removed_keys_count:
+        _print_already_synced(unchanged_keys_count)
+        return
+
+    _print_synced(added_keys_count, removed_keys_count, unchanged_keys_count)
+
 
+async def _apply_uploaded_keys(
+    database: AsyncDatabase,
+    output_dir: str,
+    decryption_key: str,
+    vault: str | None,
+    shard_index: int | None,
+    total_shards: int | None,
+    assignment: str,
+    batch_size: int,
+    jobs: int,
+    after_generation: int,
+    metrics: Metrics,
+) -> None:
+    """
+    Writes the keys uploaded after the generation, other key files are left untouched.
+    """
+    current_filenames = set(_list_key_files(output_dir))
+    current_files_count = len(current_filenames)
+    with metrics.phase('db_fetch_keys_fingerprint'):
+        fingerprint = await _fetch_fingerprint(
+            database=database,
+            vault=vault,
+            shard_index=shard_index,
+            total_shards=total_shards,
+            assignment=assignment,
+        )
+
+    added_keys_count = await _write_new_keys(
+        batches=_filter_new_keys(
+            metrics.iter_rows(
+                'db_fetch_keys',
+                _iter_shard_keys(
+                    database=database,
+                    batch_size=batch_size,
+                    vault=vault,
+                    shard_index=shard_index,
+                    total_shards=total_shards,
+                    assignment=assignment,
+                    after_generation=after_generation,
+                ),
+            ),
+            current_filenames,
+        ),
+        output_dir=output_dir,
+        decryption_key=decryption_key,
+        jobs=jobs,
+        metrics=metrics,
+    )
+    _write_manifest(output_dir, fingerprint, current_files_count + added_keys_count)
+    _print_synced(added_keys_count, 0, current_files_count)
+
+
+async def _fetch_fingerprint(
+    database: AsyncDatabase,
+    vault: str | None,
+    shard_index: int | None,
+    total_shards: int | None,
+    assignment: str,
+) -> str:
+    """
+    Returns the digest of the database keys and the shard,
+    so the files of another shard are never taken as synced.
+    """
+    fingerprint = await database.fetch_keys_fingerprint(vault=vault)
+    if total_shards is None:
+        return fingerprint
+    return f'{fingerprint}:{assignment}:{shard_index}/{total_shards}'
+
+
+async def _iter_shard_keys(
+    database: AsyncDatabase,
+    batch_size: int,
+    vault: str | None,
+    shard_index: int | None,
+    total_shards: int | None,
+    assignment: str,
+    after_generation: int | None = None,
+) -> AsyncIterator[KeyRecords]:
+    """
+    Yields the keys of the shard, the keys are assigned to the shards
+    the same way as to the validators by sync-validator.
+    All the keys are yielded without the shard.
+    """
+    if shard_index is None or total_shards is None:
+        async for records in database.iter_keys(
+            batch_size=batch_size, after_generation=after_generation, vault=vault
+        ):
+            yield records
+        return
+
+    if assignment == HASH_ASSIGNMENT:
+        # the keys of other shards are fetched, but skipped before the decryption
+        async for records in database.iter_keys(
+            batch_size=batch_size, after_generation=after_generation, vault=vault
+        ):
+            shard_records = _take_records(
+                records,
+                [
+                    index
+                    for index, record in enumerate(_iter_records(records))
+                    if get_hash_validator_index(record.public_key, total_shards) == shard_index
+                ],
+            )
+            if shard_records:
+                yield shard_records
+        return
+
+    # the range assignment fetches only the keys of the shard range
+    public_keys_count = await database.fetch_public_keys_count(vault=vault)
+    start_index, end_index = get_validator_keys_range(shard_index, total_shards, public_keys_count)
+    if end_index <= start_index:
+        return
+
+    start_after = await database.fetch_partition_boundary(
+        partition_size=public_keys_count // total_shards,
+        partition_index=shard_index,
+        vault=vault,
+    )
+
+    async for records in database.iter_keys(
+        batch_size=batch_size,
+        after_generation=after_generation,
+        vault=vault,
+        start_after=start_after,
+        limit=end_index - start_index,
+    ):
+        yield records
+
+
+async def _write_new_keys(
+    batches: AsyncIterable[KeyRecords],
+    output_dir: str,
+    decryption_key: str,
+    jobs: int,
+    metrics: Metrics,
+) -> int:
+    """
+    Decrypts the batches in the worker processes and writes their key files,
+    the files of a batch are written in a thread while the next batches are decrypted.
+    """
+    added_keys_count = 0
+    async for decrypted_keys in decrypt_private_keys(
+        batches=batches, decryption_key=decryption_key, jobs=jobs
+    ):
+        keys = decrypted_keys.keys
+        metrics.observe('aes_decrypt', seconds=decrypted_keys.decrypt_seconds, items=len(keys))
+        with metrics.phase('file_write') as phase:
+            phase.bytes += await asyncio.to_thread(_write_key_files, output_dir, keys)
+            phase.items += len(keys)
+        added_keys_count += len(keys)
+    return added_keys_count
+
+
+def _write_key_files(output_dir: str, keys: list[tuple[HexStr, HexStr]]) -> int:
+    """Returns the number of bytes written."""
+    bytes_count = 0
+    for public_key, private_key in keys:
+        content = _generate_key_file(private_key)
+        write_file_atomic(os.path.join(output_dir, _get_key_filename(public_key)), content)
+        bytes_count += len(content)
+    return bytes_count
+
+
+def _print_synced(
+    added_keys_count: int, removed_keys_count: int, unchanged_keys_count: int
+) -> None:
+    click.secho(
+        f'Web3Signer now uses {added_keys_count + unchanged_keys_count} private keys.\n'
+        f'Added: {added_keys_count}, removed: {removed_keys_count}, '
+        f'unchanged: {unchanged_keys_count}.\n',
+        bold=True,
+        fg='green',
+    )
+
+
+def _print_already_synced(keys_count: int) -> None:
     click.secho(
-        f'Web3Signer now uses {len(private_keys)} private keys.\n',
+        f'Keys already synced to the last version.\nUnchanged: {keys_count}.\n',
         bold=True,
         fg='green',
     )
 
 
+def _read_manifest(output_dir: str) -> dict | None:
+    """
+    Reads the fingerprint of the database and the number of keys written by the last sync.
+    """
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILENAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _write_manifest(output_dir: str, fingerprint: str, keys_count: int) -> None:
+    write_file_atomic(
+        os.path.join(output_dir, MANIFEST_FILENAME),
+        json.dumps({'fingerprint': fingerprint, 'keys_count': keys_count}),
+    )
+
+
+async def _filter_new_keys(
+    batches: AsyncIterable[KeyRecords], current_filenames: set[str]
+) -> AsyncIterator[KeyRecords]:
+    """
+    Yields the records without key files.
+    Filenames of the existing keys are discarded from `current_filenames`.
+    """
+    async for records in batches:
+        new_indexes = []
+        for index, record in enumerate(_iter_records(records)):
+            filename = _get_key_filename(record.public_key)
+            if filename in current_filenames:
+                current_filenames.discard(filename)
+            else:
+                new_indexes.append(index)
+        if new_indexes:
+            yield _take_records(records, new_indexes)
+
+
+def _iter_records(records: KeyRecords) -> Iterator[DatabaseKeyRecord | KeyBatchRow]:
+    yield from records
+
+
+def _take_records(records: KeyRecords, indexes: list[int]) -> KeyRecords:
+    if isinstance(records, KeyBatch):
+        return records.take(indexes)
+    return [records[index] for index in indexes]
+
+
+def _list_key_files(output_dir: str) -> list[str]:
+    return [
+        filename for filename in os.listdir(output_dir) if filename.endswith(KEY_FILE_EXTENSION)
+    ]
+
+
+def _get_key_filename(public_key: HexStr) -> str:
+    return f'{public_key}{KEY_FILE_EXTENSION}'
+
+
 def _generate_key_file(private_key: str) -> str:
     item = {
         'type': 'file-raw',
@@ -1,22 +1,32 @@
-import glob
-import json
+import asyncio
 import os
 from pathlib import Path
+from typing import AsyncIterable, AsyncIterator, Callable, cast
 
 import click
-from py_ecc.bls import G2ProofOfPossession
-from staking_deposit.key_handling.keystore import ScryptKeystore
-from web3 import Web3
+from eth_typing import HexStr
 
-from key_manager.contrib import bytes_to_str
-from key_manager.database import Database, check_db_connection
-from key_manager.encryptor import Encryptor
+from key_manager.commands import UPDATE_DB_HELP
+from key_manager.contrib import async_chunkify, async_command, bytes_to_str, chunkify
+from key_manager.database import KEYS_SCHEMA_V1, AsyncDatabase
+from key_manager.encryptor import PRIVATE_KEY_LENGTH, Encryptor
+from key_manager.journal import UploadJournal
+from key_manager.keystores import (
+    decrypt_keystores,
+    list_keystore_files,
+    read_keystore_public_key,
+)
+from key_manager.metrics import JSON_FORMAT, METRICS_FORMATS, Metrics, create_metrics
+from key_manager.public_keys import FIXED_BASE_SOURCE, PUBLIC_KEY_SOURCES
 from key_manager.settings import CONFIG_DIR
-from key_manager.typings import DatabaseKeyRecord
+from key_manager.typings import (
+    DatabaseKeyRecord,
+    DecryptedKeystore,
+    KeyBatch,
+    KeyRecords,
+)
 from key_manager.validators import validate_db_uri
 
-w3 = Web3()
-
 
 @click.option(
     '--vault',
@@ -55,88 +65,315 @@ w3 = Web3()
     default=False,
     help='Skips confirmation messages when provided.',
 )
-@click.command(help='Encrypt and load validator keys from the keystores into the database.')
-def update_db(
+@click.option(
+    '--jobs',
+    help='The number of processes used to decrypt the keystores. Defaults to the CPU count.',
+    default=lambda: os.cpu_count() or 1,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    '--public-key-source',
+    help='The way to get public keys of the keystores: derive with the fixed-base tables, '
+    'derive with the py_ecc reference implementation, or trust the keystore pubkey field. '
+    f'Defaults to {FIXED_BASE_SOURCE}.',
+    default=FIXED_BASE_SOURCE,
+    type=click.Choice(PUBLIC_KEY_SOURCES),
+)
+@click.option(
+    '--batch-size',
+    help='The number of keys uploaded to the database in one transaction. Defaults to 1000.',
+    default=1000,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    '--journal-file',
+    help='The file to record the keystores of the committed batches to, '
+    'so an interrupted import can be resumed. No journal is written without the file.',
+    type=click.Path(exists=False, file_okay=True, dir_okay=False),
+)
+@click.option(
+    '--resume',
+    is_flag=True,
+    default=False,
+    help='Continue the interrupted import from the last committed batch. '
+    'The keystore files of the committed batches are skipped without reading them. '
+    'Requires the journal file and the encryption key of the interrupted import.',
+)
+@click.option(
+    '--assign-vault',
+    is_flag=True,
+    default=False,
+    help='Assign the vault to the keys of the keystores already stored without vault, '
+    'such as the keys uploaded by the versions before the vaults. '
+    'The keys of other vaults are left untouched.',
+)
+@click.option(
+    '--metrics-file',
+    help='The file to save the durations and counters of the command phases to.',
+    type=click.Path(exists=False, file_okay=True, dir_okay=False),
+)
+@click.option(
+    '--metrics-format',
+    help=f'The format of the metrics file: JSON or the Prometheus textfile collector format. '
+    f'Defaults to {JSON_FORMAT}.',
+    default=JSON_FORMAT,
+    type=click.Choice(METRICS_FORMATS),
+)
+@click.command(help=UPDATE_DB_HELP)
+@async_command
+async def update_db(
     vault: str,
     keystores_dir: str | Path | None,
     keystores_password_file: str | Path | None,
     db_url: str,
     encryption_key: str | None,
     no_confirm: bool,
+    jobs: int,
+    public_key_source: str,
+    batch_size: int,
+    journal_file: str | None,
+    resume: bool,
+    assign_vault: bool,
+    metrics_file: str | None,
+    metrics_format: str,
 ) -> None:
-    check_db_connection(db_url)
+    if resume and not encryption_key:
+        raise click.BadParameter('--resume requires the --encryption-key of the interrupted import')
+    if resume and not journal_file:
+        raise click.BadParameter('--resume requires the --journal-file of the interrupted import')
 
+    metrics = create_metrics('update-db', metrics_file, metrics_format)
     vault_dir = CONFIG_DIR / vault
 
+    journal = UploadJournal(journal_file) if journal_file else None
+    encryptor = Encryptor(encryption_key)
+    if journal and resume:
+        journal.load(encryptor.bytes_key)
+
     keystores_dir = keystores_dir or vault_dir / 'keystores'
     keystores_password_file = keystores_password_file or vault_dir / 'keystores' / 'password.txt'
 
     with open(str(keystores_password_file), 'r', encoding='utf-8') as f:
         keystores_password = f.read().strip()
 
-    private_keys = []
-
-    with click.progressbar(
-        glob.glob(os.path.join(str(keystores_dir), 'keystore-*.json')),
-        label='Loading keystores...\t\t',
-        show_percent=False,
-        show_pos=True,
-    ) as _keystore_files:
-        for filename in _keystore_files:
-            try:
-                keystore = ScryptKeystore.from_file(filename).decrypt(keystores_password)
-                private_keys.append(int.from_bytes(keystore, 'big'))
-            except (json.JSONDecodeError, KeyError) as e:
-                click.secho(
-                    f'Failed to load keystore {filename}. Error: {str(e)}.',
-                    fg='red',
-                )
+    async with AsyncDatabase(db_url=db_url) as database:
+        # skip keystores which public keys are already in the database
+        with metrics.phase('db_fetch_public_keys') as phase:
+            database_public_keys = set(await database.fetch_public_keys())
+            phase.rows += len(database_public_keys)
 
-    database = Database(
-        db_url=db_url,
-    )
-    encryptor = Encryptor(encryption_key)
+        with metrics.phase('read_keystore_public_keys') as phase:
+            keystore_files, skipped_keystores_count, stored_public_keys = _find_new_keystores(
+                keystores_dir=keystores_dir,
+                database_public_keys=database_public_keys,
+                journal=journal,
+            )
+            phase.items += len(keystore_files) + skipped_keystores_count
 
-    database_records = _encrypt_private_keys(
-        private_keys=private_keys,
-        encryptor=encryptor,
-    )
-    if not no_confirm:
-        click.confirm(
-            f'Fetched {len(private_keys)} validator keys, upload them to the database?',
-            default=True,
-            abort=True,
-        )
-    database.upload_keys(keys=database_records)
-    total_keys_count = database.fetch_public_keys_count()
+        if not no_confirm:
+            click.confirm(
+                f'Found {len(keystore_files)} new keystores, upload them to the database?',
+                default=True,
+                abort=True,
+            )
+
+        # the stored keys can be uploaded without vault, e.g. before the vault column was added
+        assigned_keys_count = 0
+        if assign_vault:
+            assigned_keys_count = await _assign_keys_vault(
+                database=database,
+                public_keys=stored_public_keys,
+                vault=vault,
+                batch_size=batch_size,
+                metrics=metrics,
+            )
+
+        if journal and not resume:
+            journal.start(encryptor.bytes_key)
+
+        # the keys are encrypted in the layout of the keys table, a new table uses the v2 layout
+        schema_version = await database.fetch_schema_version()
+
+        with click.progressbar(
+            length=len(keystore_files),
+            label='Loading keystores...\t\t',
+            show_percent=False,
+            show_pos=True,
+        ) as progress_bar:
+            keystores_batches = async_chunkify(
+                _filter_failed_keystores(
+                    decrypt_keystores(
+                        filenames=keystore_files,
+                        password=keystores_password,
+                        public_key_source=public_key_source,
+                        jobs=jobs,
+                    ),
+                    on_progress=progress_bar.update,
+                    metrics=metrics,
+                ),
+                batch_size,
+            )
+            # the previous batch is uploaded while the next one is decrypted and encrypted
+            upload: asyncio.Task | None = None
+            async for keystores in keystores_batches:
+                with metrics.phase('aes_encrypt') as phase:
+                    database_records = await asyncio.to_thread(
+                        _encrypt_private_keys,
+                        keystores=keystores,
+                        encryptor=encryptor,
+                        schema_version=schema_version,
+                        vault=vault,
+                    )
+                    phase.items += len(database_records)
+                if upload:
+                    await upload
+                upload = asyncio.create_task(
+                    _upload_keys(
+                        database=database,
+                        keys=database_records,
+                        keystores=keystores,
+                        journal=journal,
+                        metrics=metrics,
+                    )
+                )
+            if upload:
+                await upload
+
+        with metrics.phase('db_fetch_public_keys_count'):
+            total_keys_count = await database.fetch_public_keys_count()
+            vault_keys_count = await database.fetch_public_keys_count(vault=vault)
 
     click.clear()
 
+    if assign_vault:
+        click.secho(f'Assigned {assigned_keys_count} stored keys to the vault.', bold=True)
     click.secho(
-        f'The database contains {total_keys_count} validator keys.\n'
+        f'Skipped {skipped_keystores_count} keystores already present in the database.\n'
+        f'The database contains {total_keys_count} validator keys, '
+        f'{vault_keys_count} of them belong to the vault.\n'
         f"The decryption key: '{encryptor.str_key}'",
         bold=True,
         fg='green',
     )
 
 
-def _encrypt_private_keys(private_keys: list[int], encryptor: Encryptor) -> list[DatabaseKeyRecord]:
+def _find_new_keystores(
+    keystores_dir: str | Path,
+    database_public_keys: set[HexStr],
+    journal: UploadJournal | None,
+) -> tuple[list[str], int, list[HexStr]]:
     """
-    Returns prepared database key records from the private keys.
+    Returns the keystore files to upload, the number of the skipped keystores
+    and the public keys of the skipped keystores found in the database.
+    The keystores of the journal batches are skipped without reading them.
     """
+    keystore_files = []
+    skipped_keystores_count = 0
+    stored_public_keys: list[HexStr] = []
+    for filename in list_keystore_files(keystores_dir):
+        if journal and os.path.abspath(filename) in journal.files:
+            skipped_keystores_count += 1
+            continue
+        public_key = read_keystore_public_key(filename)
+        if public_key in database_public_keys:
+            skipped_keystores_count += 1
+            stored_public_keys.append(cast(HexStr, public_key))
+            continue
+        keystore_files.append(filename)
+    return keystore_files, skipped_keystores_count, stored_public_keys
+
+
+async def _assign_keys_vault(
+    database: AsyncDatabase,
+    public_keys: list[HexStr],
+    vault: str,
+    batch_size: int,
+    metrics: Metrics,
+) -> int:
+    assigned_keys_count = 0
+    with metrics.phase('db_assign_keys_vault') as phase:
+        for chunk in chunkify(public_keys, batch_size):
+            assigned_keys_count += await database.assign_keys_vault(public_keys=chunk, vault=vault)
+        phase.rows += assigned_keys_count
+    return assigned_keys_count
 
-    click.secho('Encrypting database keys...', bold=True)
-    key_records: list[DatabaseKeyRecord] = []
-    for private_key in private_keys:
-        encrypted_private_key, nonce = encryptor.encrypt(str(private_key))
 
-        key_record = DatabaseKeyRecord(
-            public_key=w3.to_hex(G2ProofOfPossession.SkToPk(private_key)),
-            private_key=bytes_to_str(encrypted_private_key),
-            nonce=bytes_to_str(nonce),
+async def _upload_keys(
+    database: AsyncDatabase,
+    keys: KeyRecords,
+    keystores: list[DecryptedKeystore],
+    journal: UploadJournal | None,
+    metrics: Metrics,
+) -> None:
+    """
+    Uploads the batch in its own transaction and records its keystores in the journal,
+    if any, once the batch is committed. The journal line is synced to the disk in a thread,
+    so the event loop keeps feeding the keystore decryption.
+    """
+    with metrics.phase('db_upload_keys') as phase:
+        await database.upload_keys(keys=keys)
+        phase.rows += len(keys)
+    if journal:
+        await asyncio.to_thread(
+            journal.append,
+            files=[os.path.abspath(keystore.filename) for keystore in keystores],
+            public_keys=[cast(HexStr, keystore.public_key) for keystore in keystores],
         )
 
-        if key_record not in key_records:
-            key_records.append(key_record)
 
-    return key_records
+async def _filter_failed_keystores(
+    keystores: AsyncIterable[DecryptedKeystore],
+    on_progress: Callable[[int], None],
+    metrics: Metrics,
+) -> AsyncIterator[DecryptedKeystore]:
+    async for keystore in keystores:
+        on_progress(1)
+        metrics.observe('keystore_decrypt', seconds=keystore.decrypt_seconds, items=1)
+        metrics.observe('public_key_derivation', seconds=keystore.public_key_seconds, items=1)
+        if keystore.private_key is None:
+            metrics.observe('keystore_failed', items=1)
+            click.secho(
+                f'Failed to load keystore {keystore.filename}. Error: {keystore.error}.',
+                fg='red',
+            )
+            continue
+        yield keystore
+
+
+def _encrypt_private_keys(
+    keystores: list[DecryptedKeystore],
+    encryptor: Encryptor,
+    schema_version: int | None,
+    vault: str,
+) -> KeyRecords:
+    """
+    Returns prepared database key records of the vault from the decrypted keystores.
+    """
+
+    private_keys: dict[HexStr, int] = {}
+    for keystore in keystores:
+        private_keys.setdefault(cast(HexStr, keystore.public_key), cast(int, keystore.private_key))
+
+    if schema_version == KEYS_SCHEMA_V1:
+        key_records: list[DatabaseKeyRecord] = []
+        for public_key, private_key in private_keys.items():
+            encrypted_private_key, nonce = encryptor.encrypt(str(private_key))
+            key_records.append(
+                DatabaseKeyRecord(
+                    public_key=public_key,
+                    private_key=bytes_to_str(encrypted_private_key),
+                    nonce=bytes_to_str(nonce),
+                    vault=vault,
+                )
+            )
+        return key_records
+
+    encrypted_private_keys = encryptor.encrypt_many(
+        [private_key.to_bytes(PRIVATE_KEY_LENGTH, 'big') for private_key in private_keys.values()]
+    )
+    batch = KeyBatch()
+    for public_key, (data, nonce) in zip(private_keys, encrypted_private_keys):
+        batch.append(
+            public_key=bytes.fromhex(public_key[2:]), private_key=data, nonce=nonce, vault=vault
+        )
+    return batch
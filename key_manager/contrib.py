@@ -1,7 +1,15 @@
 import asyncio
-import collections
+import itertools
 from base64 import b64decode, b64encode
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from functools import wraps
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable, Iterator, TypeVar
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+PENDING_TASKS_PER_JOB = 4
 
 
 def async_command(f):
@@ -22,5 +30,51 @@ def str_to_bytes(value: str) -> bytes:
     return b64decode(value)
 
 
-def is_lists_equal(x: list, y: list) -> bool:
-    return collections.Counter(x) == collections.Counter(y)
+def chunkify(items: Iterable[T], size: int) -> Iterator[list[T]]:
+    iterator = iter(items)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+async def async_chunkify(items: AsyncIterable[T], size: int) -> AsyncIterator[list[T]]:
+    chunk: list[T] = []
+    async for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def async_process_map(
+    func: Callable[[T], R], items: Iterable[T] | AsyncIterable[T], jobs: int
+) -> AsyncIterator[R]:
+    """
+    Applies `func` to the items in `jobs` worker processes, or in a worker thread
+    for one job, without blocking the event loop.
+    Results are yielded in the order of `items`, the number of pending results
+    is bounded so a slow consumer does not accumulate them.
+    `func` must be picklable, e.g. a module-level function or its partial.
+    """
+    loop = asyncio.get_running_loop()
+    executor: Executor = (
+        ThreadPoolExecutor(max_workers=1) if jobs <= 1 else ProcessPoolExecutor(max_workers=jobs)
+    )
+    with executor:
+        pending: deque[asyncio.Future[R]] = deque()
+        async for item in _to_async_iterator(items):
+            if len(pending) >= jobs * PENDING_TASKS_PER_JOB:
+                yield await pending.popleft()
+            pending.append(loop.run_in_executor(executor, func, item))
+        while pending:
+            yield await pending.popleft()
+
+
+async def _to_async_iterator(items: Iterable[T] | AsyncIterable[T]) -> AsyncIterator[T]:
+    if isinstance(items, AsyncIterable):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
@@ -1,90 +1,1006 @@
+# pylint: disable=too-many-lines
+import asyncio
+import io
+import select
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Generator, Iterator, TypeVar, cast
+
 import click
 import psycopg2
 from eth_typing import HexStr
-from psycopg2.extras import execute_values
+from psycopg2 import errorcodes
+from psycopg2.extensions import connection, cursor
+
+from key_manager.typings import (
+    DatabaseKeyRecord,
+    KeyBatch,
+    KeyBatchRow,
+    KeyRecords,
+    KeysMetadata,
+)
+
+T = TypeVar('T')
+
+KEYS_UPDATED_CHANNEL = 'keys_updated'
+
+# the errors of the lost connection: the server restart, the idle timeout or the network failure
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+# the keys table layouts: text columns, and bytea columns with the raw private key ciphertext
+KEYS_SCHEMA_V1 = 1
+KEYS_SCHEMA_V2 = 2
+
+# the table filled by the migration to the v2 layout and the name the v1 table is kept under
+MIGRATION_TABLE = 'keys_v2'
+LEGACY_TABLE = 'keys_v1'
+
+# order independent key record hash, the table hash is the sum of the record hashes.
+# The text and bytea columns are concatenated by the same expression.
+KEY_HASH_SQL = (
+    "('x' || SUBSTR(MD5(public_key || ':' || private_key || ':' || nonce), 1, 15))::BIT(60)::BIGINT"
+)
 
-from key_manager.typings import DatabaseKeyRecord
+# the columns of the key records, the vault is empty for the keys uploaded without vault
+KEY_RECORD_COLUMNS_SQL = 'public_key, private_key, nonce, vault'
 
+# the key record columns of the tables created before the vault column was added
+LEGACY_KEY_RECORD_COLUMNS_SQL = "public_key, private_key, nonce, '' AS vault"
+
+# the stored partition boundaries are reset by every change of the keys
+RESET_PARTITIONS_SQL = 'partition_size = NULL, partition_boundaries = NULL'
+
+# the statement triggers keeping the metadata up to date with every change of the keys table
+KEYS_METADATA_TRIGGERS = {
+    'keys_metadata_insert': 'INSERT ON keys REFERENCING NEW TABLE AS added_keys',
+    'keys_metadata_update': 'UPDATE ON keys '
+    'REFERENCING OLD TABLE AS removed_keys NEW TABLE AS added_keys',
+    'keys_metadata_delete': 'DELETE ON keys REFERENCING OLD TABLE AS removed_keys',
+    'keys_metadata_truncate': 'TRUNCATE ON keys',
+}
+
+KEYS_COLUMNS_SQL = {
+    KEYS_SCHEMA_V1: 'public_key TEXT UNIQUE NOT NULL, '
+    'private_key TEXT UNIQUE NOT NULL, '
+    'nonce TEXT NOT NULL',
+    KEYS_SCHEMA_V2: 'public_key BYTEA UNIQUE NOT NULL, '
+    'private_key BYTEA UNIQUE NOT NULL, '
+    'nonce BYTEA NOT NULL',
+}
+
+
+class Database:  # pylint: disable=too-many-public-methods
+    """
+    Holds a single connection shared by all methods during the command run.
+    Use as a context manager or call `connect` and `close` explicitly.
+    """
 
-class Database:
     def __init__(self, db_url: str):
         self.db_url = db_url
+        self._connection: connection | None = None
+        # the tables are checked by the first upload of the run
+        self._tables_created = False
+        # the tables created by the previous versions get the column with the first upload
+        self._has_vault_column = False
+
+    def __enter__(self) -> 'Database':
+        self.connect()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def connect(self) -> None:
+        """Opens the connection if needed and checks it with a ping."""
+        if self._connection is not None and not self._connection.closed:
+            return
+        try:
+            self._connection = psycopg2.connect(dsn=self.db_url)
+            with self._connection, self._connection.cursor() as cur:
+                cur.execute('SELECT 1')
+        except psycopg2.OperationalError as e:
+            raise click.ClickException(
+                f'Error: failed to connect to the database server with provided URL. '
+                f'Error details: {e}',
+            )
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def reconnect(self) -> None:
+        """
+        Replaces the connection after the connection error.
+        The channels are not subscribed on the new connection.
+        """
+        self.close()
+        self.connect()
+
+    @contextmanager
+    def _cursor(self, name: str | None = None) -> Iterator[cursor]:
+        """
+        Yields a cursor, the transaction is committed on exit.
+        Named cursors are declared on the server and fetch rows on demand.
+        """
+        self.connect()
+        conn = cast(connection, self._connection)
+        with conn, conn.cursor(name=name) as cur:
+            yield cur
+
+    def listen(self, channel: str) -> None:
+        """Subscribes the connection to the notifications of the channel."""
+        with self._cursor() as cur:
+            cur.execute(f'LISTEN {channel}')
+
+    def wait_for_notification(self, timeout: float) -> bool:
+        """
+        Waits for a notification on the subscribed channels.
+        Returns False if nothing was received within `timeout` seconds.
+        """
+        self.connect()
+        conn = cast(connection, self._connection)
+        if not conn.notifies:
+            if select.select([conn], [], [], timeout) == ([], [], []):
+                return False
+            conn.poll()
+        received = bool(conn.notifies)
+        conn.notifies.clear()
+        return received
+
+    def fetch_schema_version(self) -> int | None:
+        """
+        Returns the layout of the keys table, None if the table does not exist.
+        """
+        with self._cursor() as cur:
+            return _get_schema_version(cur)
+
+    def upload_keys(self, keys: KeyRecords) -> None:
+        """
+        Adds the batch of keys to the database.
+        The batch is copied into a staging table and merged into the keys table,
+        existing public keys are left untouched.
+        A new keys table is created with the layout of the records:
+        the v2 layout for the key batch and the v1 layout for the list of records.
+        """
+        if not keys:
+            return
+        schema_version = KEYS_SCHEMA_V2 if isinstance(keys, KeyBatch) else KEYS_SCHEMA_V1
+        with self._cursor() as cur:
+            if not self._tables_created:
+                _create_tables(cur, schema_version)
+
+            # lock metadata until the batch is committed
+            cur.execute('SELECT generation FROM keys_metadata FOR UPDATE')
+            generation = cur.fetchone()[0] + 1
+
+            # the table could be migrated after the records were encrypted
+            if _get_schema_version(cur) != schema_version:
+                raise click.ClickException(
+                    'Error: the layout of the keys table has changed, run the command again.'
+                )
+            _copy_keys_to_staging(cur, table='keys', keys=keys)
+
+            # merge keys and stamp the generation in the same transaction,
+            # the keys count and hash are added by the metadata triggers
+            cur.execute(
+                """
+                WITH inserted AS (
+                    INSERT INTO keys (public_key, private_key, nonce, vault, generation)
+                    SELECT public_key, private_key, nonce, vault, %(generation)s FROM keys_staging
+                    ON CONFLICT DO NOTHING
+                    RETURNING vault
+                ), vaults AS (
+                    INSERT INTO keys_vaults_metadata (vault, generation, keys_count, keys_hash)
+                    SELECT DISTINCT vault, %(generation)s, 0, 0 FROM inserted
+                    ON CONFLICT (vault) DO UPDATE SET generation = EXCLUDED.generation
+                )
+                UPDATE keys_metadata SET generation = %(generation)s
+                WHERE EXISTS (SELECT 1 FROM inserted);
+                """,
+                {'generation': generation},
+            )
+
+            # listeners are notified when the transaction is committed
+            if cur.rowcount:
+                cur.execute('SELECT pg_notify(%s, %s)', (KEYS_UPDATED_CHANNEL, str(generation)))
+        self._tables_created = True
+        self._has_vault_column = True
+
+    def assign_keys_vault(self, public_keys: list[HexStr], vault: str) -> int:
+        """
+        Assigns the vault to the keys stored without vault, such as the keys uploaded
+        before the vault column was added. The keys of other vaults are left untouched.
+        The assigned keys are stamped with a new generation like the uploaded keys,
+        so the syncs and the running migration see the change.
+        Returns the number of the assigned keys.
+        """
+        schema_version = self.fetch_schema_version()
+        if not public_keys or schema_version is None:
+            return 0
+        with self._cursor() as cur:
+            if not self._tables_created:
+                _create_tables(cur, schema_version)
 
-    def upload_keys(self, keys: list[DatabaseKeyRecord]) -> None:
-        """Updates database records to new state."""
-        with _get_db_connection(self.db_url) as conn:
-            with conn.cursor() as cur:
-                # recreate table
+            # the same lock order as in upload_keys, the keys count and hash
+            # of the vaults are moved by the metadata triggers
+            cur.execute('SELECT generation FROM keys_metadata FOR UPDATE')
+            params = {
+                'vault': _normalize_vault(vault),
+                'generation': cur.fetchone()[0] + 1,
+                'public_keys': [_to_column_public_key(x, schema_version) for x in public_keys],
+                'channel': KEYS_UPDATED_CHANNEL,
+            }
+            cur.execute(
+                "UPDATE keys SET vault = %(vault)s, generation = %(generation)s "
+                "WHERE vault = '' AND public_key = ANY(%(public_keys)s)",
+                params,
+            )
+            assigned_count = cur.rowcount
+            if assigned_count:
                 cur.execute(
                     """
-                    CREATE TABLE IF NOT EXISTS keys (
-                        public_key TEXT UNIQUE NOT NULL,
-                        private_key TEXT UNIQUE NOT NULL,
-                        nonce TEXT NOT NULL
-                    );
-                    """
+                    UPDATE keys_vaults_metadata SET generation = %(generation)s
+                    WHERE vault = %(vault)s;
+                    UPDATE keys_metadata SET generation = %(generation)s;
+                    SELECT pg_notify(%(channel)s, %(generation)s::TEXT);
+                    """,
+                    params,
                 )
+        self._tables_created = True
+        self._has_vault_column = True
+        return assigned_count
 
-                # insert keys
-                execute_values(
-                    cur,
-                    'INSERT INTO keys (public_key, private_key, nonce) '
-                    'VALUES %s ON CONFLICT DO NOTHING',
-                    [
-                        (
-                            x.public_key,
-                            x.private_key,
-                            x.nonce,
-                        )
-                        for x in keys
-                    ],
+    def fetch_public_keys_by_range(
+        self, start_after: HexStr | None, limit: int, vault: str | None = None
+    ) -> list[HexStr]:
+        """
+        Returns up to `limit` public keys following `start_after` in public key order.
+        Uses the public key index, so the cost does not depend on the range position.
+        """
+        condition, params = self._get_vault_condition(vault)
+        with self._cursor() as cur:
+            if start_after is None:
+                cur.execute(
+                    f'SELECT public_key FROM keys WHERE {condition} '
+                    'ORDER BY public_key LIMIT %s;',
+                    (*params, limit),
                 )
-
-    def fetch_public_keys_by_range(self, start_index: int, end_index: int) -> list[HexStr]:
-        with _get_db_connection(self.db_url) as conn:
-            with conn.cursor() as cur:
+            else:
+                # the byte order of the v2 public keys is the order of their hex strings
                 cur.execute(
-                    'SELECT public_key FROM keys ORDER BY public_key LIMIT %s OFFSET %s;',
-                    (end_index - start_index, start_index),
+                    f'SELECT public_key FROM keys WHERE {condition} AND public_key > %s '
+                    'ORDER BY public_key LIMIT %s;',
+                    (*params, _to_column_public_key(start_after, _get_schema_version(cur)), limit),
                 )
-                rows = cur.fetchall()
-                return [row[0] for row in rows]
+            rows = cur.fetchall()
+            return [_to_public_key(row[0]) for row in rows]
 
-    def fetch_public_keys_count(self) -> int:
-        with _get_db_connection(self.db_url) as conn:
-            with conn.cursor() as cur:
+    def fetch_partition_boundary(
+        self, partition_size: int, partition_index: int, vault: str | None = None
+    ) -> HexStr | None:
+        """
+        Returns the last public key of the partitions of `partition_size` keys
+        preceding the partition, None for the first partition.
+        The boundaries of all the partitions are computed by one scan of the public key index
+        and stored with the keys metadata, so the following calls for any partition read
+        a single boundary until the keys change. The tables without the metadata
+        skip the preceding keys on the public key index.
+        """
+        if partition_size < 1 or partition_index < 1:
+            return None
+        table, metadata_condition, metadata_params = _get_metadata_condition(vault)
+        condition, params = self._get_vault_condition(vault)
+        with self._cursor() as cur:
+            try:
+                # the boundaries are reset by the triggers of the keys table
+                cur.execute(
+                    f'SELECT partition_boundaries[%s] FROM {table} '
+                    f'WHERE {metadata_condition} AND partition_size = %s',
+                    (partition_index, *metadata_params, partition_size),
+                )
+            except psycopg2.ProgrammingError as e:
+                if e.pgcode != errorcodes.UNDEFINED_TABLE:
+                    raise
+                cur.connection.rollback()
                 cur.execute(
-                    'SELECT COUNT(public_key) FROM keys',
+                    f'SELECT public_key FROM keys WHERE {condition} '
+                    'ORDER BY public_key OFFSET %s LIMIT 1;',
+                    (*params, partition_index * partition_size - 1),
                 )
                 row = cur.fetchone()
+                return _to_public_key(row[0]) if row else None
+            row = cur.fetchone()
+            if row:
                 return row[0]
 
-    def fetch_keys(self) -> list[DatabaseKeyRecord]:
-        with _get_db_connection(self.db_url) as conn:
-            with conn.cursor() as cur:
-                cur.execute('SELECT * FROM keys ORDER BY public_key')
-                rows = cur.fetchall()
-                return [
-                    DatabaseKeyRecord(
-                        public_key=row[0],
-                        private_key=row[1],
-                        nonce=row[2],
-                    )
-                    for row in rows
-                ]
-
-
-def check_db_connection(db_url):
-    connection = _get_db_connection(db_url=db_url)
-    try:
-        cur = connection.cursor()
-        cur.execute('SELECT 1')
-    except psycopg2.OperationalError as e:
-        raise click.ClickException(
-            f'Error: failed to connect to the database server with provided URL. '
-            f'Error details: {e}',
+            # the metadata and the boundaries are read from the same snapshot
+            public_key_sql = (
+                "'0x' || ENCODE(public_key, 'hex')"
+                if _get_schema_version(cur) == KEYS_SCHEMA_V2
+                else 'public_key'
+            )
+            cur.execute(
+                f"""
+                SELECT generation, keys_count, keys_hash, ARRAY(
+                    SELECT {public_key_sql} FROM (
+                        SELECT public_key, ROW_NUMBER() OVER (ORDER BY public_key) AS position
+                        FROM keys WHERE {condition}
+                    ) AS positions
+                    WHERE position %% %s = 0 ORDER BY position
+                ) FROM {table} WHERE {metadata_condition}
+                """,
+                (*params, partition_size, *metadata_params),
+            )
+            row = cur.fetchone()
+        if not row:
+            return None
+        *metadata, boundaries = row
+        self._store_partition_boundaries(vault, tuple(metadata), partition_size, boundaries)
+        return boundaries[partition_index - 1] if partition_index <= len(boundaries) else None
+
+    def _store_partition_boundaries(
+        self, vault: str | None, metadata: tuple, partition_size: int, boundaries: list[HexStr]
+    ) -> None:
+        """
+        Stores the boundaries unless the `(generation, keys_count, keys_hash)` metadata
+        has changed since they were computed. The metadata row is updated in its own
+        transaction, so the keys table is not locked while waiting for the row.
+        """
+        table, condition, params = _get_metadata_condition(vault)
+        try:
+            with self._cursor() as cur:
+                cur.execute(
+                    f'UPDATE {table} SET partition_size = %s, partition_boundaries = %s '
+                    f'WHERE {condition} AND generation = %s AND keys_count = %s AND keys_hash = %s',
+                    (partition_size, boundaries, *params, *metadata),
+                )
+        except psycopg2.Error as e:
+            # the boundaries are computed again by the readers without the write access
+            if e.pgcode not in (
+                errorcodes.INSUFFICIENT_PRIVILEGE,
+                errorcodes.READ_ONLY_SQL_TRANSACTION,
+            ):
+                raise
+
+    def iter_public_keys(
+        self, batch_size: int, vault: str | None = None
+    ) -> Generator[list[HexStr], None, None]:
+        """
+        Yields public keys in public key order by batches of `batch_size`
+        using a server-side cursor.
+        """
+        condition, params = self._get_vault_condition(vault)
+        with self._cursor(name='public_keys_cursor') as cur:
+            cur.itersize = batch_size
+            cur.execute(
+                f'SELECT public_key FROM keys WHERE {condition} ORDER BY public_key', params
+            )
+            while rows := cur.fetchmany(batch_size):
+                yield [_to_public_key(row[0]) for row in rows]
+
+    def fetch_public_keys(self, vault: str | None = None) -> list[HexStr]:
+        condition, params = self._get_vault_condition(vault)
+        with self._cursor() as cur:
+            try:
+                cur.execute(f'SELECT public_key FROM keys WHERE {condition}', params)
+            except psycopg2.ProgrammingError as e:
+                if e.pgcode == errorcodes.UNDEFINED_TABLE:
+                    return []
+                raise
+            rows = cur.fetchall()
+            return [_to_public_key(row[0]) for row in rows]
+
+    def fetch_public_keys_count(self, vault: str | None = None) -> int:
+        metadata = self.fetch_keys_metadata(vault=vault)
+        if metadata:
+            return metadata.keys_count
+
+        condition, params = self._get_vault_condition(vault)
+        with self._cursor() as cur:
+            cur.execute(f'SELECT COUNT(public_key) FROM keys WHERE {condition}', params)
+            row = cur.fetchone()
+            return row[0]
+
+    def fetch_keys_metadata(self, vault: str | None = None) -> KeysMetadata | None:
+        """
+        Returns the generation, count and content hash of the keys table.
+        The generation is increased by `upload_keys`, the count and hash are maintained
+        by the triggers of the keys table. Returns None if the keys were never uploaded
+        by the version maintaining the metadata.
+        With `vault` returns the metadata of the vault keys, the generation
+        is the last generation which added keys to the vault.
+        """
+        table, condition, params = _get_metadata_condition(vault)
+        with self._cursor() as cur:
+            try:
+                cur.execute(
+                    f'SELECT generation, keys_count, keys_hash FROM {table} WHERE {condition}',
+                    params,
+                )
+            except psycopg2.ProgrammingError as e:
+                if e.pgcode == errorcodes.UNDEFINED_TABLE:
+                    return None
+                raise
+            row = cur.fetchone()
+            if not row:
+                return None
+            return KeysMetadata(generation=row[0], keys_count=row[1], keys_hash=str(row[2]))
+
+    def fetch_uploaded_keys_metadata(
+        self, after_generation: int, generation: int, vault: str | None = None
+    ) -> KeysMetadata:
+        """
+        Returns the count and hash of the keys uploaded after `after_generation`
+        up to `generation`. Computed by the database server through the generation index.
+        """
+        condition, params = self._get_vault_condition(vault)
+        with self._cursor() as cur:
+            cur.execute(
+                f'SELECT COUNT(*), COALESCE(SUM({KEY_HASH_SQL}), 0) FROM keys '
+                f'WHERE {condition} AND generation > %s AND generation <= %s',
+                (*params, after_generation, generation),
+            )
+            row = cur.fetchone()
+            return KeysMetadata(generation=generation, keys_count=row[0], keys_hash=str(row[1]))
+
+    def fetch_keys_fingerprint(self, vault: str | None = None) -> str:
+        """
+        Returns the digest of all encrypted key records.
+        Taken from the keys metadata when available, otherwise computed
+        by the database server, so only the digest is transferred.
+        """
+        metadata = self.fetch_keys_metadata(vault=vault)
+        if metadata:
+            return f'{metadata.generation}:{metadata.keys_count}:{metadata.keys_hash}'
+
+        condition, params = self._get_vault_condition(vault)
+        with self._cursor() as cur:
+            cur.execute(
+                "SELECT COALESCE(MD5(STRING_AGG("
+                "MD5(public_key || ':' || private_key || ':' || nonce), '' ORDER BY public_key"
+                f")), '') FROM keys WHERE {condition}",
+                params,
+            )
+            row = cur.fetchone()
+            return row[0]
+
+    def fetch_keys(self, vault: str | None = None) -> KeyRecords:
+        columns = self._get_key_record_columns_sql()
+        condition, params = self._get_vault_condition(vault)
+        with self._cursor() as cur:
+            cur.execute(f'SELECT {columns} FROM keys WHERE {condition} ORDER BY public_key', params)
+            rows = cur.fetchall()
+            return _to_key_records(rows)
+
+    def iter_keys(
+        self,
+        batch_size: int,
+        after_generation: int | None = None,
+        vault: str | None = None,
+        start_after: HexStr | None = None,
+        limit: int | None = None,
+    ) -> Generator[KeyRecords, None, None]:
+        """
+        Yields key records in public key order by batches of `batch_size`
+        using a server-side cursor, so the table is never loaded at once.
+        With `after_generation` only the keys uploaded after that generation are yielded.
+        With `start_after` and `limit` only the range of the keys is yielded,
+        the same range as of `fetch_public_keys_by_range`.
+        The records of both layouts are yielded, the layout is taken from the column values:
+        the v2 records as key batches and the v1 records as lists.
+        """
+        # the columns are read before the server-side cursor is declared
+        columns = self._get_key_record_columns_sql()
+        condition, params = self._get_vault_condition(vault)
+        if after_generation is not None:
+            condition += ' AND generation > %s'
+            params += (after_generation,)
+        if start_after is not None:
+            condition += ' AND public_key > %s'
+            params += (_to_column_public_key(start_after, self.fetch_schema_version()),)
+        with self._cursor(name='keys_cursor') as cur:
+            cur.itersize = batch_size
+            # LIMIT NULL returns all the rows
+            cur.execute(
+                f'SELECT {columns} FROM keys WHERE {condition} ORDER BY public_key LIMIT %s',
+                (*params, limit),
+            )
+            while rows := cur.fetchmany(batch_size):
+                yield _to_key_records(rows)
+
+    def _fetch_has_vault_column(self) -> bool:
+        """
+        Returns whether the keys table has the vault column.
+        The keys of the tables without the column belong to the empty vault.
+        """
+        if not self._has_vault_column:
+            with self._cursor() as cur:
+                self._has_vault_column = 'vault' in _get_keys_columns(cur)
+        return self._has_vault_column
+
+    def _get_key_record_columns_sql(self) -> str:
+        if self._fetch_has_vault_column():
+            return KEY_RECORD_COLUMNS_SQL
+        return LEGACY_KEY_RECORD_COLUMNS_SQL
+
+    def _get_vault_condition(self, vault: str | None) -> tuple[str, tuple]:
+        """Returns the keys table condition selecting the keys of the vault and its parameters."""
+        if vault is None:
+            return 'TRUE', ()
+        if not self._fetch_has_vault_column():
+            # all the keys of the table without the vault column were uploaded without vault
+            return ('TRUE' if not vault else 'FALSE'), ()
+        return 'vault = %s', (_normalize_vault(vault),)
+
+    def prepare_keys_migration(self) -> KeysMetadata:
+        """
+        Creates the empty table of the v2 layout next to the v1 keys table,
+        a table left by an interrupted migration is recreated.
+        Returns the metadata of the keys table.
+        """
+        with self._cursor() as cur:
+            _create_tables(cur, KEYS_SCHEMA_V1)
+            cur.execute(
+                f"""
+                DROP TABLE IF EXISTS {MIGRATION_TABLE};
+                CREATE TABLE {MIGRATION_TABLE} (
+                    {KEYS_COLUMNS_SQL[KEYS_SCHEMA_V2]},
+                    generation BIGINT NOT NULL DEFAULT 0,
+                    vault TEXT NOT NULL DEFAULT ''
+                );
+                CREATE INDEX {MIGRATION_TABLE}_generation_idx ON {MIGRATION_TABLE} (generation);
+                CREATE INDEX {MIGRATION_TABLE}_vault_idx ON {MIGRATION_TABLE} (vault, public_key);
+                """
+            )
+            cur.execute('SELECT generation, keys_count, keys_hash FROM keys_metadata')
+            row = cur.fetchone()
+            return KeysMetadata(generation=row[0], keys_count=row[1], keys_hash=str(row[2]))
+
+    def upload_migrated_keys(self, keys: KeyBatch, generation: int) -> None:
+        """
+        Adds the converted keys of the generation to the migration table,
+        the keys copied by the previous passes are left untouched.
+        """
+        with self._cursor() as cur:
+            _copy_keys_to_staging(cur, table=MIGRATION_TABLE, keys=keys)
+            cur.execute(
+                f"""
+                INSERT INTO {MIGRATION_TABLE} (public_key, private_key, nonce, vault, generation)
+                SELECT public_key, private_key, nonce, vault, %s FROM keys_staging
+                ON CONFLICT DO NOTHING;
+                """,
+                (generation,),
+            )
+
+    def finish_keys_migration(self, metadata: KeysMetadata) -> bool:
+        """
+        Replaces the keys table by the migration table if the keys table has not changed
+        since the metadata, returns False otherwise. The removed and updated keys
+        do not change the generation, so the keys count and hash are compared too.
+        The v1 table is kept as the legacy table.
+        The metadata generation is increased, so the watching syncs are notified.
+        """
+        with self._cursor() as cur:
+            # the same lock order as in upload_keys: the metadata row and then the keys table
+            cur.execute('SELECT generation, keys_count, keys_hash FROM keys_metadata FOR UPDATE')
+            row = cur.fetchone()
+            if (
+                KeysMetadata(generation=row[0], keys_count=row[1], keys_hash=str(row[2]))
+                != metadata
+            ):
+                return False
+            cur.execute('LOCK TABLE keys IN ACCESS EXCLUSIVE MODE')
+
+            cur.execute(
+                f"""
+                ALTER TABLE keys RENAME TO {LEGACY_TABLE};
+                {_get_drop_metadata_triggers_sql(LEGACY_TABLE)}
+                ALTER INDEX keys_generation_idx RENAME TO {LEGACY_TABLE}_generation_idx;
+                ALTER INDEX keys_vault_idx RENAME TO {LEGACY_TABLE}_vault_idx;
+                ALTER TABLE {MIGRATION_TABLE} RENAME TO keys;
+                ALTER INDEX {MIGRATION_TABLE}_generation_idx RENAME TO keys_generation_idx;
+                ALTER INDEX {MIGRATION_TABLE}_vault_idx RENAME TO keys_vault_idx;
+                """
+            )
+            _create_metadata_triggers(cur)
+            cur.execute(
+                f"""
+                UPDATE keys_metadata SET
+                    generation = generation + 1,
+                    keys_count = (SELECT COUNT(*) FROM keys),
+                    keys_hash = (SELECT COALESCE(SUM({KEY_HASH_SQL}), 0) FROM keys),
+                    {RESET_PARTITIONS_SQL};
+                DELETE FROM keys_vaults_metadata;
+                INSERT INTO keys_vaults_metadata (vault, generation, keys_count, keys_hash)
+                SELECT vault, %(generation)s, COUNT(*), SUM({KEY_HASH_SQL}) FROM keys
+                GROUP BY vault;
+                """,
+                {'generation': metadata.generation + 1},
+            )
+            cur.execute(
+                'SELECT pg_notify(%s, %s)', (KEYS_UPDATED_CHANNEL, str(metadata.generation + 1))
+            )
+            return True
+
+
+class AsyncDatabase:
+    """
+    Async version of `Database` for the commands running on the event loop.
+    psycopg2 is blocking, so the queries run in a dedicated thread
+    which also serializes them on the single connection,
+    while the loop keeps scheduling the CPU work in the executor pools.
+    """
+
+    def __init__(self, db_url: str):
+        self._database = Database(db_url=db_url)
+        self._executor: ThreadPoolExecutor | None = None
+
+    async def __aenter__(self) -> 'AsyncDatabase':
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    async def _run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='database')
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    async def connect(self) -> None:
+        await self._run(self._database.connect)
+
+    async def close(self) -> None:
+        if self._executor is None:
+            return
+        await self._run(self._database.close)
+        self._executor.shutdown()
+        self._executor = None
+
+    async def reconnect(self) -> None:
+        await self._run(self._database.reconnect)
+
+    async def listen(self, channel: str) -> None:
+        await self._run(self._database.listen, channel)
+
+    async def wait_for_notification(self, timeout: float) -> bool:
+        return await self._run(self._database.wait_for_notification, timeout=timeout)
+
+    async def fetch_schema_version(self) -> int | None:
+        return await self._run(self._database.fetch_schema_version)
+
+    async def upload_keys(self, keys: KeyRecords) -> None:
+        await self._run(self._database.upload_keys, keys=keys)
+
+    async def assign_keys_vault(self, public_keys: list[HexStr], vault: str) -> int:
+        return await self._run(
+            self._database.assign_keys_vault, public_keys=public_keys, vault=vault
+        )
+
+    async def fetch_public_keys_by_range(
+        self, start_after: HexStr | None, limit: int, vault: str | None = None
+    ) -> list[HexStr]:
+        return await self._run(
+            self._database.fetch_public_keys_by_range,
+            start_after=start_after,
+            limit=limit,
+            vault=vault,
         )
 
+    async def fetch_partition_boundary(
+        self, partition_size: int, partition_index: int, vault: str | None = None
+    ) -> HexStr | None:
+        return await self._run(
+            self._database.fetch_partition_boundary,
+            partition_size=partition_size,
+            partition_index=partition_index,
+            vault=vault,
+        )
+
+    async def fetch_public_keys(self, vault: str | None = None) -> list[HexStr]:
+        return await self._run(self._database.fetch_public_keys, vault=vault)
+
+    async def fetch_public_keys_count(self, vault: str | None = None) -> int:
+        return await self._run(self._database.fetch_public_keys_count, vault=vault)
+
+    async def fetch_keys_metadata(self, vault: str | None = None) -> KeysMetadata | None:
+        return await self._run(self._database.fetch_keys_metadata, vault=vault)
+
+    async def fetch_uploaded_keys_metadata(
+        self, after_generation: int, generation: int, vault: str | None = None
+    ) -> KeysMetadata:
+        return await self._run(
+            self._database.fetch_uploaded_keys_metadata,
+            after_generation=after_generation,
+            generation=generation,
+            vault=vault,
+        )
+
+    async def fetch_keys_fingerprint(self, vault: str | None = None) -> str:
+        return await self._run(self._database.fetch_keys_fingerprint, vault=vault)
+
+    async def fetch_keys(self, vault: str | None = None) -> KeyRecords:
+        return await self._run(self._database.fetch_keys, vault=vault)
+
+    def iter_public_keys(
+        self, batch_size: int, vault: str | None = None
+    ) -> AsyncIterator[list[HexStr]]:
+        """Async version of `Database.iter_public_keys`."""
+        return self._iterate(self._database.iter_public_keys(batch_size=batch_size, vault=vault))
+
+    def iter_keys(
+        self,
+        batch_size: int,
+        after_generation: int | None = None,
+        vault: str | None = None,
+        start_after: HexStr | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[KeyRecords]:
+        """Async version of `Database.iter_keys`."""
+        return self._iterate(
+            self._database.iter_keys(
+                batch_size=batch_size,
+                after_generation=after_generation,
+                vault=vault,
+                start_after=start_after,
+                limit=limit,
+            )
+        )
+
+    async def _iterate(self, batches: Generator[T, None, None]) -> AsyncIterator[T]:
+        """
+        Runs the generator of batches in the database thread.
+        The next batch is fetched while the consumer processes the current one.
+        """
+        prefetch = asyncio.ensure_future(self._run(next, batches, None))
+        try:
+            while (batch := await prefetch) is not None:
+                prefetch = asyncio.ensure_future(self._run(next, batches, None))
+                yield batch
+        finally:
+            # the server-side cursor is closed in the database thread
+            await asyncio.gather(prefetch, return_exceptions=True)
+            await self._run(batches.close)
+
+
+def _create_tables(cur: cursor, schema_version: int) -> None:
+    """
+    Creates the keys table with the layout if it does not exist,
+    the keys metadata and the metadata of the vaults.
+    """
+    cur.execute(f'CREATE TABLE IF NOT EXISTS keys ({KEYS_COLUMNS_SQL[schema_version]})')
+
+    # ALTER TABLE blocks the readers even if the column exists,
+    # so only the columns missing in the tables of the previous versions are added
+    columns = _get_keys_columns(cur)
+    if 'generation' not in columns:
+        cur.execute(
+            """
+            ALTER TABLE keys ADD COLUMN IF NOT EXISTS generation BIGINT NOT NULL DEFAULT 0;
+            CREATE INDEX IF NOT EXISTS keys_generation_idx ON keys (generation);
+            """
+        )
+    if 'vault' not in columns:
+        cur.execute(
+            """
+            ALTER TABLE keys ADD COLUMN IF NOT EXISTS vault TEXT NOT NULL DEFAULT '';
+            CREATE INDEX IF NOT EXISTS keys_vault_idx ON keys (vault, public_key);
+            """
+        )
+    # the keys count and hash of the table and of each vault
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS keys_metadata (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            generation BIGINT NOT NULL,
+            keys_count BIGINT NOT NULL,
+            keys_hash NUMERIC NOT NULL,
+            partition_size BIGINT,
+            partition_boundaries TEXT[]
+        );
+        INSERT INTO keys_metadata (generation, keys_count, keys_hash) VALUES (0, 0, 0)
+        ON CONFLICT DO NOTHING;
+        CREATE TABLE IF NOT EXISTS keys_vaults_metadata (
+            vault TEXT PRIMARY KEY,
+            generation BIGINT NOT NULL,
+            keys_count BIGINT NOT NULL,
+            keys_hash NUMERIC NOT NULL,
+            partition_size BIGINT,
+            partition_boundaries TEXT[]
+        );
+        """
+    )
+    if _has_metadata_triggers(cur):
+        return
+
+    # the concurrent runs wait until the triggers are created
+    cur.execute('LOCK TABLE keys IN SHARE ROW EXCLUSIVE MODE')
+    if _has_metadata_triggers(cur):
+        return
+    _create_metadata_triggers(cur)
+
+    # the metadata left by the versions without the triggers could miss the changes
+    # made outside update-db, it is computed from the keys once
+    cur.execute(
+        f"""
+        UPDATE keys_metadata SET
+            keys_count = (SELECT COUNT(*) FROM keys),
+            keys_hash = (SELECT COALESCE(SUM({KEY_HASH_SQL}), 0) FROM keys),
+            {RESET_PARTITIONS_SQL};
+        UPDATE keys_vaults_metadata SET keys_count = 0, keys_hash = 0, {RESET_PARTITIONS_SQL};
+        INSERT INTO keys_vaults_metadata (vault, generation, keys_count, keys_hash)
+        SELECT vault, 0, COUNT(*), SUM({KEY_HASH_SQL}) FROM keys
+        GROUP BY vault
+        ON CONFLICT (vault) DO UPDATE SET
+            keys_count = EXCLUDED.keys_count,
+            keys_hash = EXCLUDED.keys_hash;
+        """
+    )
+
+
+def _has_metadata_triggers(cur: cursor) -> bool:
+    cur.execute(
+        "SELECT COUNT(*) FROM pg_trigger WHERE tgrelid = 'keys'::regclass AND tgname IN %s",
+        (tuple(KEYS_METADATA_TRIGGERS),),
+    )
+    return cur.fetchone()[0] == len(KEYS_METADATA_TRIGGERS)
+
+
+def _create_metadata_triggers(cur: cursor) -> None:
+    """
+    Creates the triggers adding the keys inserted into the keys table to the metadata
+    and subtracting the removed keys, the updated keys are removed and inserted again.
+    The changes made outside key-manager are counted as well.
+    """
+    cur.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION keys_metadata_update() RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                UPDATE keys_metadata SET keys_count = 0, keys_hash = 0, {RESET_PARTITIONS_SQL};
+                UPDATE keys_vaults_metadata SET
+                    keys_count = 0, keys_hash = 0, {RESET_PARTITIONS_SQL};
+                RETURN NULL;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE keys_metadata SET
+                    keys_count = keys_metadata.keys_count - removed.keys_count,
+                    keys_hash = keys_metadata.keys_hash - removed.keys_hash,
+                    {RESET_PARTITIONS_SQL}
+                FROM (
+                    SELECT COUNT(*) AS keys_count, COALESCE(SUM({KEY_HASH_SQL}), 0) AS keys_hash
+                    FROM removed_keys
+                ) AS removed;
+                UPDATE keys_vaults_metadata SET
+                    keys_count = keys_vaults_metadata.keys_count - removed.keys_count,
+                    keys_hash = keys_vaults_metadata.keys_hash - removed.keys_hash,
+                    {RESET_PARTITIONS_SQL}
+                FROM (
+                    SELECT vault, COUNT(*) AS keys_count, SUM({KEY_HASH_SQL}) AS keys_hash
+                    FROM removed_keys GROUP BY vault
+                ) AS removed
+                WHERE keys_vaults_metadata.vault = removed.vault;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'INSERT') THEN
+                UPDATE keys_metadata SET
+                    keys_count = keys_metadata.keys_count + added.keys_count,
+                    keys_hash = keys_metadata.keys_hash + added.keys_hash,
+                    {RESET_PARTITIONS_SQL}
+                FROM (
+                    SELECT COUNT(*) AS keys_count, COALESCE(SUM({KEY_HASH_SQL}), 0) AS keys_hash
+                    FROM added_keys
+                ) AS added;
+                INSERT INTO keys_vaults_metadata (vault, generation, keys_count, keys_hash)
+                SELECT vault, (SELECT generation FROM keys_metadata), COUNT(*), SUM({KEY_HASH_SQL})
+                FROM added_keys GROUP BY vault
+                ON CONFLICT (vault) DO UPDATE SET
+                    keys_count = keys_vaults_metadata.keys_count + EXCLUDED.keys_count,
+                    keys_hash = keys_vaults_metadata.keys_hash + EXCLUDED.keys_hash,
+                    {RESET_PARTITIONS_SQL};
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        {_get_drop_metadata_triggers_sql('keys')}
+        """
+    )
+    for name, event in KEYS_METADATA_TRIGGERS.items():
+        cur.execute(
+            f'CREATE TRIGGER {name} AFTER {event} '
+            'FOR EACH STATEMENT EXECUTE FUNCTION keys_metadata_update()'
+        )
+
+
+def _get_drop_metadata_triggers_sql(table: str) -> str:
+    return ''.join(f'DROP TRIGGER IF EXISTS {name} ON {table};' for name in KEYS_METADATA_TRIGGERS)
+
+
+def _get_keys_columns(cur: cursor) -> set[str]:
+    cur.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema() "
+        "AND table_name = 'keys'"
+    )
+    return {row[0] for row in cur.fetchall()}
+
+
+def _get_schema_version(cur: cursor) -> int | None:
+    cur.execute(
+        "SELECT data_type FROM information_schema.columns WHERE table_schema = current_schema() "
+        "AND table_name = 'keys' AND column_name = 'public_key'"
+    )
+    row = cur.fetchone()
+    if not row:
+        return None
+    return KEYS_SCHEMA_V2 if row[0] == 'bytea' else KEYS_SCHEMA_V1
+
+
+def _copy_keys_to_staging(cur: cursor, table: str, keys: KeyRecords) -> None:
+    """
+    Copies the keys into the temporary `keys_staging` table with the layout of `table`.
+    """
+    cur.execute(
+        f"""
+        CREATE TEMP TABLE keys_staging
+        (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP;
+        """
+    )
+    cur.copy_expert(
+        f'COPY keys_staging ({KEY_RECORD_COLUMNS_SQL}) FROM STDIN',
+        io.StringIO(''.join(_to_copy_row(x) for x in keys)),
+    )
+
+
+def _to_copy_row(record: DatabaseKeyRecord | KeyBatchRow) -> str:
+    if isinstance(record, KeyBatchRow):
+        # bytea hex format, the backslash is escaped in the copy text format
+        return (
+            f'\\\\x{record.public_key[2:]}\t'
+            f'\\\\x{record.private_key.hex()}\t'
+            f'\\\\x{record.nonce.hex()}\t'
+            f'{_normalize_vault(record.vault)}\n'
+        )
+    # hex and base64 values do not require escaping
+    return (
+        f'{record.public_key}\t{record.private_key}\t{record.nonce}\t'
+        f'{_normalize_vault(record.vault)}\n'
+    )
+
+
+def _to_key_records(rows: list[tuple]) -> KeyRecords:
+    # psycopg2 returns bytea values as memoryview
+    if rows and isinstance(rows[0][0], memoryview):
+        batch = KeyBatch()
+        for row in rows:
+            batch.append(public_key=row[0], private_key=row[1], nonce=row[2], vault=row[3])
+        return batch
+    return [
+        DatabaseKeyRecord(public_key=row[0], private_key=row[1], nonce=row[2], vault=row[3])
+        for row in rows
+    ]
+
+
+def _get_metadata_condition(vault: str | None) -> tuple[str, str, tuple]:
+    """Returns the metadata table of the keys of the vault, the row condition and its parameters."""
+    if vault is None:
+        return 'keys_metadata', 'TRUE', ()
+    return 'keys_vaults_metadata', 'vault = %s', (_normalize_vault(vault),)
+
+
+def _normalize_vault(vault: str) -> str:
+    # the vault addresses are stored in lower case, the checksum case is not significant
+    return vault.lower()
+
+
+def _to_public_key(value: str | memoryview) -> HexStr:
+    if isinstance(value, memoryview):
+        return HexStr(f'0x{value.hex()}')
+    return HexStr(value)
+
 
-def _get_db_connection(db_url):
-    return psycopg2.connect(dsn=db_url)
+def _to_column_public_key(public_key: HexStr, schema_version: int | None) -> str | bytes:
+    if schema_version == KEYS_SCHEMA_V2:
+        return bytes.fromhex(public_key[2:])
+    return public_key
@@ -1,13 +1,21 @@
-from typing import cast
+import time
+from functools import partial
+from typing import AsyncIterable, AsyncIterator, Iterable, cast
 
 # pycryptodome lib used
 from Crypto.Cipher import AES  # nosec
 from Crypto.Cipher._mode_eax import EaxMode  # nosec
 from Crypto.Random import get_random_bytes  # nosec
+from eth_typing import HexStr
 
-from key_manager.contrib import bytes_to_str, str_to_bytes
+from key_manager.contrib import async_process_map, bytes_to_str, str_to_bytes
+from key_manager.typings import DecryptedKeys, KeyBatch, KeyRecords
 
 CIPHER_KEY_LENGTH = 32
+PRIVATE_KEY_LENGTH = 32
+TAG_LENGTH = 16
+
+Buffer = bytes | bytearray | memoryview
 
 
 class Encryptor:
@@ -29,6 +37,29 @@ class Encryptor:
         private_key = cipher.decrypt(str_to_bytes(data))
         return private_key.decode('ascii')
 
+    def encrypt_many(self, items: Iterable[Buffer]) -> list[tuple[bytes, bytes]]:
+        """
+        Returns the ciphertext followed by the tag and the nonce of each item.
+        """
+        encrypted = []
+        for item in items:
+            cipher = self._get_cipher()
+            data, tag = cipher.encrypt_and_digest(item)
+            encrypted.append((data + tag, cipher.nonce))
+        return encrypted
+
+    def decrypt_many(self, items: Iterable[tuple[Buffer, Buffer]]) -> list[bytes]:
+        """
+        Decrypts the `(ciphertext followed by the tag, nonce)` items, the tags are verified.
+        Raises ValueError if a tag does not match.
+        """
+        return [
+            cast(EaxMode, AES.new(self.bytes_key, AES.MODE_EAX, nonce=nonce)).decrypt_and_verify(
+                data[:-TAG_LENGTH], data[-TAG_LENGTH:]
+            )
+            for data, nonce in items
+        ]
+
     def _restore_cipher(self, nonce: str) -> EaxMode:
         cipher = AES.new(self.bytes_key, AES.MODE_EAX, nonce=str_to_bytes(nonce))
         return cast(EaxMode, cipher)
@@ -39,3 +70,33 @@ class Encryptor:
     def _get_cipher(self) -> EaxMode:
         cipher = AES.new(self.bytes_key, AES.MODE_EAX)
         return cast(EaxMode, cipher)
+
+
+def decrypt_private_keys(
+    batches: Iterable[KeyRecords] | AsyncIterable[KeyRecords],
+    decryption_key: str,
+    jobs: int,
+) -> AsyncIterator[DecryptedKeys]:
+    """
+    Decrypts batches of database records of both layouts using `jobs` worker processes.
+    Yields `(public_key, private_key)` pairs of each batch in the order of `batches`
+    with the decryption time, private keys are 0x-prefixed hex strings padded to 32 bytes.
+    """
+    decrypt = partial(_decrypt_batch, decryption_key=decryption_key)
+    return async_process_map(decrypt, batches, jobs=jobs)
+
+
+def _decrypt_batch(records: KeyRecords, decryption_key: str) -> DecryptedKeys:
+    start = time.perf_counter()
+    decryptor = Encryptor(decryption_key)
+    keys = []
+    if isinstance(records, KeyBatch):
+        rows = list(records)
+        private_keys = decryptor.decrypt_many([(row.private_key, row.nonce) for row in rows])
+        for row, private_key in zip(rows, private_keys):
+            keys.append((row.public_key, HexStr(f'0x{private_key.hex()}')))
+    else:
+        for record in records:
+            private_key_int = int(decryptor.decrypt(data=record.private_key, nonce=record.nonce))
+            keys.append((record.public_key, HexStr(f'0x{private_key_int:064x}')))
+    return DecryptedKeys(keys=keys, decrypt_seconds=time.perf_counter() - start)
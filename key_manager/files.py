@@ -0,0 +1,50 @@
+import hashlib
+import os
+from typing import Iterable
+
+READ_CHUNK_SIZE = 1 << 16
+
+
+def write_file_atomic(filepath: str, content: str) -> None:
+    """
+    Writes the file through a temporary file and rename,
+    so readers never see a partially written file.
+    """
+    tmp_filepath = f'{filepath}.tmp'
+    with open(tmp_filepath, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_filepath, filepath)
+
+
+def write_file_if_changed(filepath: str, chunks: Iterable[str]) -> bool:
+    """
+    Streams the chunks to a temporary file and renames it over the file
+    unless the content hash matches the existing file.
+    The existing file is not touched when the content is the same,
+    so programs watching it are not disturbed.
+    Returns True if the file was written.
+    """
+    tmp_filepath = f'{filepath}.tmp'
+    content_hash = hashlib.sha256()
+    with open(tmp_filepath, 'w', encoding='utf-8') as f:
+        for chunk in chunks:
+            f.write(chunk)
+            content_hash.update(chunk.encode('utf-8'))
+
+    if content_hash.digest() == _get_file_hash(filepath):
+        os.remove(tmp_filepath)
+        return False
+
+    os.replace(tmp_filepath, filepath)
+    return True
+
+
+def _get_file_hash(filepath: str) -> bytes | None:
+    file_hash = hashlib.sha256()
+    try:
+        with open(filepath, 'rb') as f:
+            while chunk := f.read(READ_CHUNK_SIZE):
+                file_hash.update(chunk)
+    except FileNotFoundError:
+        return None
+    return file_hash.digest()
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import click
+from eth_typing import HexStr
+
+from key_manager.files import write_file_atomic
+
+
+class UploadJournal:
+    """
+    The local journal of update-db: the keystore files and the public keys
+    of each committed batch, one JSON line per batch after the header line.
+    A line is appended only after its batch is committed,
+    so the journal never lists keys missing from the database.
+    The encryption key is identified by its hash, the key itself is not stored.
+    """
+
+    def __init__(self, filename: str | Path):
+        self.filename = str(filename)
+        self.files: set[str] = set()
+        self.public_keys: set[HexStr] = set()
+
+    def start(self, encryption_key: bytes) -> None:
+        """Starts the journal of a new import, the previous journal is discarded."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        write_file_atomic(self.filename, json.dumps({'key_id': _get_key_id(encryption_key)}) + '\n')
+        self.files.clear()
+        self.public_keys.clear()
+
+    def load(self, encryption_key: bytes) -> None:
+        """
+        Reads the batches committed by the interrupted import.
+        The line cut by the interruption is removed.
+        """
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                content = f.read()
+        except FileNotFoundError as e:
+            raise click.ClickException(f'Error: the journal {self.filename} does not exist.') from e
+
+        if not content.endswith('\n'):
+            content = content[: content.rfind('\n') + 1]
+            with open(self.filename, 'r+', encoding='utf-8') as f:
+                f.truncate(len(content.encode('utf-8')))
+
+        lines = content.splitlines()
+        if not lines or json.loads(lines[0])['key_id'] != _get_key_id(encryption_key):
+            raise click.ClickException(
+                'Error: the encryption key differs from the key of the interrupted import.'
+            )
+        for line in lines[1:]:
+            batch = json.loads(line)
+            self.files.update(batch['files'])
+            self.public_keys.update(batch['public_keys'])
+
+    def append(self, files: list[str], public_keys: list[HexStr]) -> None:
+        """Records the committed batch, the line is flushed to the disk."""
+        with open(self.filename, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'files': files, 'public_keys': public_keys}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.files.update(files)
+        self.public_keys.update(public_keys)
+
+
+def _get_key_id(encryption_key: bytes) -> str:
+    return hashlib.sha256(encryption_key).hexdigest()
@@ -0,0 +1,73 @@
+import glob
+import json
+import os
+import time
+from functools import partial
+from pathlib import Path
+from typing import AsyncIterator
+
+from eth_typing import HexStr
+from eth_utils import add_0x_prefix
+from staking_deposit.key_handling.keystore import ScryptKeystore
+
+from key_manager.contrib import async_process_map
+from key_manager.public_keys import KEYSTORE_SOURCE, get_public_key_deriver
+from key_manager.typings import DecryptedKeystore
+
+
+def list_keystore_files(keystores_dir: str | Path) -> list[str]:
+    return glob.glob(os.path.join(str(keystores_dir), 'keystore-*.json'))
+
+
+def read_keystore_public_key(filename: str) -> HexStr | None:
+    """
+    Reads the public key from the keystore pubkey field without decrypting it.
+    """
+    try:
+        with open(filename, 'r', encoding='utf-8') as f:
+            public_key = json.load(f).get('pubkey')
+    except (json.JSONDecodeError, AttributeError):
+        return None
+    return add_0x_prefix(public_key) if public_key else None
+
+
+def decrypt_keystores(
+    filenames: list[str], password: str, public_key_source: str, jobs: int
+) -> AsyncIterator[DecryptedKeystore]:
+    """
+    Decrypts keystores and resolves their public keys using `jobs` worker processes.
+    Results are yielded in the order of `filenames`.
+    """
+    decrypt = partial(_decrypt_keystore, password=password, public_key_source=public_key_source)
+    return async_process_map(decrypt, filenames, jobs=min(jobs, len(filenames)))
+
+
+def _decrypt_keystore(filename: str, password: str, public_key_source: str) -> DecryptedKeystore:
+    start = time.perf_counter()
+    try:
+        keystore = ScryptKeystore.from_file(filename)
+        private_key = int.from_bytes(keystore.decrypt(password), 'big')
+    except (json.JSONDecodeError, KeyError) as e:
+        return DecryptedKeystore(filename=filename, error=str(e))
+    decrypt_seconds = time.perf_counter() - start
+
+    keystore_public_key = add_0x_prefix(keystore.pubkey) if keystore.pubkey else None
+    if public_key_source == KEYSTORE_SOURCE:
+        if not keystore_public_key:
+            return DecryptedKeystore(filename=filename, error='missing pubkey field')
+        public_key = keystore_public_key
+    else:
+        public_key = get_public_key_deriver(public_key_source)(private_key)
+        if keystore_public_key and keystore_public_key != public_key:
+            return DecryptedKeystore(
+                filename=filename,
+                error=f'pubkey field does not match derived public key {public_key}',
+            )
+
+    return DecryptedKeystore(
+        filename=filename,
+        private_key=private_key,
+        public_key=public_key,
+        decrypt_seconds=decrypt_seconds,
+        public_key_seconds=time.perf_counter() - start - decrypt_seconds,
+    )
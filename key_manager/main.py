@@ -1,20 +1,72 @@
+import importlib
 import multiprocessing
 
 import click
 
-from key_manager.commands.sync_validator import sync_validator
-from key_manager.commands.sync_web3signer import sync_web3signer
-from key_manager.commands.update_db import update_db
+from key_manager.commands import (
+    ASSIGNMENT_REPORT_HELP,
+    MIGRATE_DB_HELP,
+    SYNC_VALIDATOR_HELP,
+    SYNC_WEB3SIGNER_HELP,
+    UPDATE_DB_HELP,
+)
 
+# name: (module, attribute, short help)
+# command modules are imported only when the command runs, so the startup
+# does not pay for the dependencies of the other commands
+COMMANDS = {
+    'update-db': (
+        'key_manager.commands.update_db',
+        'update_db',
+        UPDATE_DB_HELP,
+    ),
+    'sync-web3signer': (
+        'key_manager.commands.sync_web3signer',
+        'sync_web3signer',
+        SYNC_WEB3SIGNER_HELP,
+    ),
+    'sync-validator': (
+        'key_manager.commands.sync_validator',
+        'sync_validator',
+        SYNC_VALIDATOR_HELP,
+    ),
+    'assignment-report': (
+        'key_manager.commands.assignment_report',
+        'assignment_report',
+        ASSIGNMENT_REPORT_HELP,
+    ),
+    'migrate-db': (
+        'key_manager.commands.migrate_db',
+        'migrate_db',
+        MIGRATE_DB_HELP,
+    ),
+}
 
-@click.group()
-def cli() -> None:
-    pass
 
+class LazyGroup(click.Group):
+    """
+    Loads the commands from `COMMANDS` on demand.
+    The group help is built from the short help in `COMMANDS`.
+    """
+
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return sorted(COMMANDS)
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> click.Command | None:
+        if cmd_name not in COMMANDS:
+            return None
+        module_name, attribute, _ = COMMANDS[cmd_name]
+        return getattr(importlib.import_module(module_name), attribute)
 
-cli.add_command(update_db)
-cli.add_command(sync_web3signer)
-cli.add_command(sync_validator)
+    def format_commands(self, ctx: click.Context, formatter: click.HelpFormatter) -> None:
+        rows = [(cmd_name, COMMANDS[cmd_name][2]) for cmd_name in self.list_commands(ctx)]
+        with formatter.section('Commands'):
+            formatter.write_dl(rows)
+
+
+@click.group(cls=LazyGroup)
+def cli() -> None:
+    pass
 
 
 if __name__ == '__main__':
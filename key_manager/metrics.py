@@ -0,0 +1,126 @@
+import json
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import AsyncIterable, AsyncIterator, Iterator, Sized, TypeVar
+
+import click
+
+from key_manager.files import write_file_atomic
+
+JSON_FORMAT = 'json'
+PROMETHEUS_FORMAT = 'prometheus'
+
+METRICS_FORMATS = [JSON_FORMAT, PROMETHEUS_FORMAT]
+
+PROMETHEUS_METRICS = {
+    'seconds': 'Time spent in the phase, summed over the worker processes for worker phases.',
+    'items': 'Number of items processed in the phase.',
+    'rows': 'Number of database rows transferred in the phase.',
+    'bytes': 'Number of bytes written in the phase.',
+}
+
+T = TypeVar('T', bound=Sized)
+
+
+@dataclass
+class PhaseMetrics:
+    seconds: float = 0.0
+    items: int = 0
+    rows: int = 0
+    bytes: int = 0
+
+
+class Metrics:
+    """
+    Collects the durations and counters of the command phases.
+    Phases measured several times accumulate their values.
+    """
+
+    def __init__(self, command: str):
+        self.command = command
+        self.phases: dict[str, PhaseMetrics] = {}
+        self._start = time.perf_counter()
+
+    def get(self, name: str) -> PhaseMetrics:
+        if name not in self.phases:
+            self.phases[name] = PhaseMetrics()
+        return self.phases[name]
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[PhaseMetrics]:
+        """Measures the wall time of the block, the counters are set through the yielded value."""
+        phase = self.get(name)
+        start = time.perf_counter()
+        try:
+            yield phase
+        finally:
+            phase.seconds += time.perf_counter() - start
+
+    def observe(
+        self, name: str, seconds: float = 0.0, items: int = 0, rows: int = 0, bytes_count: int = 0
+    ) -> None:
+        phase = self.get(name)
+        phase.seconds += seconds
+        phase.items += items
+        phase.rows += rows
+        phase.bytes += bytes_count
+
+    async def iter_rows(self, name: str, batches: AsyncIterable[T]) -> AsyncIterator[T]:
+        """
+        Yields the batches fetched from the database, measures the time spent
+        waiting for them and counts the rows.
+        """
+        iterator = aiter(batches)
+        while True:
+            start = time.perf_counter()
+            batch = await anext(iterator, None)
+            self.observe(name, seconds=time.perf_counter() - start, rows=len(batch) if batch else 0)
+            if batch is None:
+                return
+            yield batch
+
+    def to_dict(self) -> dict:
+        return {
+            'command': self.command,
+            'total_seconds': time.perf_counter() - self._start,
+            'phases': {name: asdict(phase) for name, phase in self.phases.items()},
+        }
+
+    def to_prometheus(self) -> str:
+        """Formats the metrics for the node exporter textfile collector."""
+        data = self.to_dict()
+        lines = [
+            '# HELP key_manager_total_seconds Time spent in the command.',
+            '# TYPE key_manager_total_seconds gauge',
+            f'key_manager_total_seconds{{command="{self.command}"}} {data["total_seconds"]}',
+        ]
+        for metric, description in PROMETHEUS_METRICS.items():
+            lines.append(f'# HELP key_manager_phase_{metric} {description}')
+            lines.append(f'# TYPE key_manager_phase_{metric} gauge')
+            for name, phase in data['phases'].items():
+                lines.append(
+                    f'key_manager_phase_{metric}{{command="{self.command}",phase="{name}"}} '
+                    f'{phase[metric]}'
+                )
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filepath: str, metrics_format: str) -> None:
+        if metrics_format == PROMETHEUS_FORMAT:
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=4)
+        write_file_atomic(filepath, content)
+
+
+def create_metrics(command: str, metrics_file: str | None, metrics_format: str) -> Metrics:
+    """
+    Returns the metrics of the command run.
+    The metrics are saved to `metrics_file` when the command exits, also on errors.
+    """
+    metrics = Metrics(command=command)
+    if metrics_file:
+        click.get_current_context().call_on_close(
+            lambda: metrics.write(metrics_file, metrics_format)
+        )
+    return metrics
@@ -0,0 +1,71 @@
+from functools import lru_cache
+from typing import Callable
+
+from eth_typing import HexStr
+from eth_utils import to_hex
+from py_ecc.bls import G2ProofOfPossession
+from py_ecc.bls.g2_primitives import G1_to_pubkey
+from py_ecc.optimized_bls12_381 import G1, Z1, add, curve_order
+from py_ecc.typing import Optimized_Point3D
+
+KEYSTORE_SOURCE = 'keystore'
+FIXED_BASE_SOURCE = 'fixed-base'
+PY_ECC_SOURCE = 'py-ecc'
+
+PUBLIC_KEY_SOURCES = [FIXED_BASE_SOURCE, PY_ECC_SOURCE, KEYSTORE_SOURCE]
+
+# fixed-base comb window in bits, the table holds 2^WINDOW_BITS points per window
+WINDOW_BITS = 8
+WINDOWS_COUNT = (curve_order.bit_length() + WINDOW_BITS - 1) // WINDOW_BITS
+
+
+def py_ecc_public_key(private_key: int) -> HexStr:
+    """
+    Reference implementation of the public key derivation.
+    """
+    return to_hex(G2ProofOfPossession.SkToPk(private_key))
+
+
+def fixed_base_public_key(private_key: int) -> HexStr:
+    """
+    Derives the public key using the precomputed multiples of the G1 generator.
+    Replaces ~380 point doublings and additions of the generic
+    scalar multiplication with at most `WINDOWS_COUNT` additions.
+    """
+    if not 0 < private_key < curve_order:
+        raise ValueError('Invalid private key')
+
+    table = _get_g1_table()
+    point = Z1
+    for window in range(WINDOWS_COUNT):
+        digit = (private_key >> (window * WINDOW_BITS)) & ((1 << WINDOW_BITS) - 1)
+        if digit:
+            point = add(point, table[window][digit])
+
+    return to_hex(G1_to_pubkey(point))
+
+
+def get_public_key_deriver(source: str) -> Callable[[int], HexStr]:
+    if source == PY_ECC_SOURCE:
+        return py_ecc_public_key
+    if source == FIXED_BASE_SOURCE:
+        return fixed_base_public_key
+
+    raise ValueError(f'Public key source {source} does not derive keys')
+
+
+@lru_cache(maxsize=None)
+def _get_g1_table() -> list[list[Optimized_Point3D]]:
+    """
+    Returns `table[window][digit] = digit * 2^(window * WINDOW_BITS) * G1`.
+    Built once per process.
+    """
+    table = []
+    base = G1
+    for _ in range(WINDOWS_COUNT):
+        row = [Z1, base]
+        for _ in range(2, 1 << WINDOW_BITS):
+            row.append(add(row[-1], base))
+        table.append(row)
+        base = add(row[-1], base)
+    return table
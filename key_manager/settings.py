@@ -8,3 +8,5 @@ GNOSIS = 'gnosis'
 AVAILABLE_NETWORKS = [GOERLI]
 
 CONFIG_DIR = Path.home() / '.stakewise'
+
+DECRYPTION_KEY_ENV = 'DECRYPTION_KEY'
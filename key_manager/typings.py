@@ -1,10 +1,172 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, NamedTuple
 
 from eth_typing import HexStr
 
+# the widths of the key batch columns: the public key, the 32-byte private key ciphertext
+# followed by the 16-byte tag, and the nonce
+PUBLIC_KEY_WIDTH = 48
+PRIVATE_KEY_WIDTH = 48
+NONCE_WIDTH = 16
+
 
 @dataclass
 class DatabaseKeyRecord:
+    """
+    The key record of the v1 layout: the base64 ciphertext and nonce
+    of the decimal string of the private key.
+    """
+
     public_key: HexStr
     private_key: str
     nonce: str
+    vault: str = ''
+
+
+@dataclass
+class BinaryKeyRecord:
+    """
+    The key record of the v2 layout: the ciphertext of the 32-byte private key
+    followed by the 16-byte EAX tag, and the 16-byte nonce.
+    The public key is stored as 48 bytes.
+    """
+
+    public_key: HexStr
+    private_key: bytes
+    nonce: bytes
+    vault: str = ''
+
+
+KeyRecord = DatabaseKeyRecord | BinaryKeyRecord
+
+
+class KeyBatchRow(NamedTuple):
+    """
+    The key record of a `KeyBatch`, the private key and the nonce are views of the batch buffers.
+    """
+
+    public_key: HexStr
+    private_key: memoryview
+    nonce: memoryview
+    vault: str
+
+
+@dataclass
+class KeyBatch:
+    """
+    The key records of the v2 layout stored by columns.
+    The public keys, private keys and nonces are fixed-width columns of contiguous buffers,
+    so a batch holds a few objects instead of several objects per key
+    and is pickled to the worker processes as a few buffers.
+    The vault strings are interned per batch, so the keys of the vault share a single string
+    also when the vaults are read from the database rows.
+    The batch can not be extended while the views of its rows are referenced.
+    """
+
+    public_keys: bytearray = field(default_factory=bytearray)
+    private_keys: bytearray = field(default_factory=bytearray)
+    nonces: bytearray = field(default_factory=bytearray)
+    vaults: list[str] = field(default_factory=list)
+    _vault_names: dict[str, str] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+
+    @classmethod
+    def from_records(cls, records: Iterable[BinaryKeyRecord]) -> 'KeyBatch':
+        batch = cls()
+        for record in records:
+            batch.append(
+                public_key=bytes.fromhex(record.public_key[2:]),
+                private_key=record.private_key,
+                nonce=record.nonce,
+                vault=record.vault,
+            )
+        return batch
+
+    def append(
+        self,
+        public_key: bytes | memoryview,
+        private_key: bytes | memoryview,
+        nonce: bytes | memoryview,
+        vault: str = '',
+    ) -> None:
+        if (len(public_key), len(private_key), len(nonce)) != (
+            PUBLIC_KEY_WIDTH,
+            PRIVATE_KEY_WIDTH,
+            NONCE_WIDTH,
+        ):
+            raise ValueError('Invalid key record size')
+        self.public_keys += public_key
+        self.private_keys += private_key
+        self.nonces += nonce
+        self.vaults.append(self._vault_names.setdefault(vault, vault))
+
+    def take(self, indexes: Iterable[int]) -> 'KeyBatch':
+        """Returns the batch of the rows with the indexes."""
+        batch = KeyBatch()
+        for index in indexes:
+            batch.public_keys += _get_cell(self.public_keys, PUBLIC_KEY_WIDTH, index)
+            batch.private_keys += _get_cell(self.private_keys, PRIVATE_KEY_WIDTH, index)
+            batch.nonces += _get_cell(self.nonces, NONCE_WIDTH, index)
+            batch.vaults.append(self.vaults[index])
+        return batch
+
+    def to_records(self) -> list[BinaryKeyRecord]:
+        return [
+            BinaryKeyRecord(
+                public_key=row.public_key,
+                private_key=bytes(row.private_key),
+                nonce=bytes(row.nonce),
+                vault=row.vault,
+            )
+            for row in self
+        ]
+
+    def __len__(self) -> int:
+        return len(self.vaults)
+
+    def __getitem__(self, index: int) -> KeyBatchRow:
+        if not -len(self) <= index < len(self):
+            raise IndexError('key batch index out of range')
+        index %= len(self)
+        return KeyBatchRow(
+            public_key=HexStr(f'0x{_get_cell(self.public_keys, PUBLIC_KEY_WIDTH, index).hex()}'),
+            private_key=_get_cell(self.private_keys, PRIVATE_KEY_WIDTH, index),
+            nonce=_get_cell(self.nonces, NONCE_WIDTH, index),
+            vault=self.vaults[index],
+        )
+
+    def __iter__(self) -> Iterator[KeyBatchRow]:
+        for index in range(len(self)):
+            yield self[index]
+
+
+# the records fetched and uploaded at once: the columns of the v2 layout or the v1 records
+KeyRecords = KeyBatch | list[DatabaseKeyRecord]
+
+
+@dataclass
+class DecryptedKeystore:
+    filename: str
+    private_key: int | None = None
+    public_key: HexStr | None = None
+    error: str | None = None
+    decrypt_seconds: float = 0.0
+    public_key_seconds: float = 0.0
+
+
+@dataclass
+class DecryptedKeys:
+    keys: list[tuple[HexStr, HexStr]]
+    decrypt_seconds: float = 0.0
+
+
+@dataclass
+class KeysMetadata:
+    generation: int
+    keys_count: int
+    keys_hash: str
+
+
+def _get_cell(column: bytearray, width: int, index: int) -> memoryview:
+    return memoryview(column)[index * width : (index + 1) * width]
@@ -29,7 +29,7 @@ class W3Provider(BaseProvider):
         return '0x' + ''.join(random.choices('abcdef' + string.digits, k=194))
 
     def eth_public_key(self) -> str:
-        return '0x' + ''.join(random.choices('abcdef' + string.digits, k=98))
+        return '0x' + ''.join(random.choices('abcdef' + string.digits, k=96))
 
     def wei_amount(self) -> Wei:
         eth_value = faker.random_int(10, 1000)
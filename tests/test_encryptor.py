@@ -0,0 +1,39 @@
+import os
+import unittest
+
+from Crypto.Cipher import AES  # nosec
+
+from key_manager.encryptor import TAG_LENGTH, Encryptor
+
+
+class TestEncryptor(unittest.TestCase):
+    def test_batch_compatibility(self):
+        encryptor = Encryptor()
+        # the private key sizes and other sizes, including the empty item
+        for sizes in ([32] * 50, [16, 48, 5, 0, 32]):
+            items = [os.urandom(size) for size in sizes]
+            encrypted = encryptor.encrypt_many(items)
+            for item, (data, nonce) in zip(items, encrypted):
+                cipher = AES.new(encryptor.bytes_key, AES.MODE_EAX, nonce=nonce)
+                assert cipher.decrypt_and_verify(data[:-TAG_LENGTH], data[-TAG_LENGTH:]) == item
+
+            encrypted = []
+            for item in items:
+                cipher = AES.new(encryptor.bytes_key, AES.MODE_EAX)
+                data, tag = cipher.encrypt_and_digest(item)
+                encrypted.append((memoryview(data + tag), cipher.nonce))
+            assert encryptor.decrypt_many(encrypted) == items
+
+    def test_batch_tag_verification(self):
+        encryptor = Encryptor()
+        encrypted = [
+            (bytes(data), bytes(nonce))
+            for data, nonce in encryptor.encrypt_many([os.urandom(32) for _ in range(10)])
+        ]
+        data, nonce = encrypted[7]
+        encrypted[7] = (data[:5] + bytes([data[5] ^ 1]) + data[6:], nonce)
+        with self.assertRaises(ValueError):
+            encryptor.decrypt_many(encrypted)
+
+        with self.assertRaises(ValueError):
+            Encryptor().decrypt_many(encrypted[:1])
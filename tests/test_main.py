@@ -0,0 +1,39 @@
+import subprocess  # nosec
+import sys
+import unittest
+
+import click
+from click.testing import CliRunner
+
+from key_manager.main import COMMANDS, cli
+
+
+class TestMain(unittest.TestCase):
+    def test_commands(self):
+        ctx = click.Context(cli)
+        for cmd_name, (_, _, short_help) in COMMANDS.items():
+            command = cli.get_command(ctx, cmd_name)
+            assert isinstance(command, click.Command)
+            assert command.name == cmd_name
+            # the group lists the short help of the command
+            assert command.get_short_help_str(limit=1000) == short_help
+
+        result = CliRunner().invoke(cli, ['--help'])
+        assert result.exit_code == 0
+        for cmd_name in COMMANDS:
+            assert cmd_name in result.output
+
+    def test_lazy_loading(self):
+        code = (
+            'import sys\n'
+            'from key_manager.main import cli\n'
+            'try:\n'
+            "    cli(['--help'])\n"
+            'except SystemExit:\n'
+            '    pass\n'
+            "print(sorted(x for x in sys.modules if x.startswith('key_manager.commands.')))\n"
+        )
+        result = subprocess.run(  # nosec
+            [sys.executable, '-c', code], check=True, capture_output=True, text=True
+        )
+        assert result.stdout.strip().endswith('[]')
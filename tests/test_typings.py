@@ -0,0 +1,48 @@
+import pickle
+import unittest
+
+from key_manager.typings import BinaryKeyRecord, KeyBatch
+
+from .factories import faker
+
+
+class TestKeyBatch(unittest.TestCase):
+    def test_records(self):
+        records = [
+            BinaryKeyRecord(
+                public_key=faker.eth_public_key(),
+                private_key=bytes([index] * 48),
+                nonce=bytes([index] * 16),
+                vault='vault' if index % 2 else '',
+            )
+            for index in range(5)
+        ]
+        batch = KeyBatch.from_records(records)
+
+        assert len(batch) == 5
+        assert batch.to_records() == records
+        assert [x.public_key for x in batch] == [x.public_key for x in records]
+        assert batch[-2].vault == 'vault'
+        # the vault strings of the fetched rows are shared
+        fetched_batch = KeyBatch()
+        for vault in ['vault', 'vault']:
+            fetched_batch.append(
+                public_key=bytes(48), private_key=bytes(48), nonce=bytes(16), vault=vault.upper()
+            )
+        assert fetched_batch.vaults[0] is fetched_batch.vaults[1]
+        assert bytes(batch[1].private_key) == records[1].private_key
+        assert batch.take([3, 1]).to_records() == [records[3], records[1]]
+        assert not batch.take([])
+
+        # the rows are views of the column buffers
+        row = batch[2]
+        assert row.nonce.obj is batch.nonces
+        del row
+
+        assert pickle.loads(pickle.dumps(batch)) == batch
+        with self.assertRaises(IndexError):
+            batch[5]  # pylint: disable=pointless-statement
+
+    def test_invalid_size(self):
+        with self.assertRaises(ValueError):
+            KeyBatch().append(public_key=bytes(48), private_key=bytes(32), nonce=bytes(16))